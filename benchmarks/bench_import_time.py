@@ -0,0 +1,33 @@
+import subprocess
+import sys
+import time
+
+# Wall clock time of importing jax3dp3 and its subsystems in a fresh interpreter.
+# Exits with status 1 if `import jax3dp3` takes longer than max_seconds.
+
+STATEMENTS = (
+    "import jax",
+    "import jax3dp3",
+    "import jax3dp3; jax3dp3.threedp3_likelihood",
+    "import jax3dp3; jax3dp3.Renderer",
+    "import jax3dp3; jax3dp3.viz",
+)
+
+def time_import(statement, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        subprocess.run([sys.executable, "-c", statement], check=True)
+        times.append(time.time() - start)
+    return min(times)
+
+def run(max_seconds=None):
+    times = {statement: time_import(statement) for statement in STATEMENTS}
+    for (statement, t) in times.items():
+        print(f"{t:>8.3f}s  {statement}")
+    if max_seconds is not None and times["import jax3dp3"] > max_seconds:
+        print(f"import jax3dp3 took longer than {max_seconds}s")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    run(max_seconds=float(sys.argv[1]) if len(sys.argv) > 1 else None)
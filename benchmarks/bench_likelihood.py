@@ -0,0 +1,42 @@
+import time
+import jax
+import jax.numpy as jnp
+import jax3dp3
+from jax3dp3.likelihood import count_ii_jj
+
+# Compares threedp3_likelihood (shifted stencil) against the previous per-pixel
+# gather formulation built on count_ii_jj.
+
+def threedp3_likelihood_gather(obs_xyz, rendered_xyz, r, outlier_prob, outlier_volume, filter_size=3):
+    obs_mask = obs_xyz[:,:,2] > 0.0
+    rendered_mask = rendered_xyz[:,:,2] > 0.0
+    rendered_xyz_padded = jax.lax.pad(rendered_xyz,  -100.0, ((filter_size,filter_size,0,),(filter_size,filter_size,0,),(0,0,0,)))
+    jj, ii = jnp.meshgrid(jnp.arange(obs_xyz.shape[1]), jnp.arange(obs_xyz.shape[0]))
+    indices = jnp.stack([ii,jj],axis=-1)
+    counts = count_ii_jj(indices, obs_xyz, rendered_xyz_padded, r, filter_size)
+    num_latent_points = rendered_mask.sum()
+    probs = outlier_prob / outlier_volume + (1.0 - outlier_prob) / num_latent_points / (4/3 * jnp.pi * r**3) * counts
+    return jnp.sum(jnp.where(obs_mask, jnp.log(probs), 0.0))
+
+def time_fn(f, *args, repeats=3):
+    f(*args).block_until_ready()
+    start = time.time()
+    for _ in range(repeats):
+        f(*args).block_until_ready()
+    return (time.time() - start) / repeats
+
+def run(image_sizes=((60, 80), (120, 160), (240, 320)), batch_sizes=(1, 16, 64)):
+    key = jax.random.PRNGKey(0)
+    print(f"{'image':>10} {'batch':>6} {'gather (s)':>12} {'stencil (s)':>12} {'speedup':>8}")
+    for (h, w) in image_sizes:
+        for n in batch_sizes:
+            obs = jax.random.uniform(key, (h, w, 3), minval=0.5, maxval=1.0)
+            rendered = obs[None] + 0.05 * jax.random.normal(key, (n, h, w, 3))
+            gather = jax.jit(jax.vmap(threedp3_likelihood_gather, in_axes=(None, 0, None, None, None)))
+            stencil = jax.jit(jax.vmap(jax3dp3.threedp3_likelihood, in_axes=(None, 0, None, None, None)))
+            t_gather = time_fn(gather, obs, rendered, 0.05, 0.01, 1.0)
+            t_stencil = time_fn(stencil, obs, rendered, 0.05, 0.01, 1.0)
+            print(f"{h:>4}x{w:<5} {n:>6} {t_gather:>12.4f} {t_stencil:>12.4f} {t_gather / t_stencil:>7.1f}x")
+
+if __name__ == "__main__":
+    run()
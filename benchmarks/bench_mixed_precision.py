@@ -0,0 +1,77 @@
+import os
+import time
+import jax
+import jax.numpy as jnp
+import trimesh
+import jax3dp3
+import jax3dp3.transforms_3d as t3d
+
+# Compares score_parallel with float32 against bfloat16 and float16 renderers on
+# synthetic cube scenes. Reports the largest score error against float32, absolute
+# and as a fraction of the range of float32 scores in the scene (scores cross
+# zero, so errors relative to each score are meaningless). For every scene the
+# best pose under reduced precision is looked up in the float32 ranking; rank 0
+# means both pick the same pose.
+
+h, w, fx, fy, cx, cy = 120, 160, 200.0, 200.0, 80.0, 60.0
+near, far = 0.01, 50.0
+r, outlier_prob, outlier_volume = 0.02, 0.01, 1.0
+
+def make_proposals(center, num_translations=6, num_rotations=8):
+    offsets = jnp.linspace(-0.1, 0.1, num_translations)
+    translations = jnp.stack(jnp.meshgrid(offsets, offsets, offsets), axis=-1).reshape(-1, 3)
+    angles = jnp.linspace(0.0, jnp.pi / 2, num_rotations, endpoint=False)
+    rotations = jax.vmap(lambda a: t3d.transform_from_axis_angle(jnp.array([0.0, 1.0, 0.0]), a))(angles)
+    translations = jax.vmap(t3d.transform_from_pos)(center + translations)
+    return jnp.einsum("aij,bjk->abik", translations, rotations).reshape(-1, 4, 4)
+
+def time_fn(f, repeats=3):
+    f().block_until_ready()
+    start = time.time()
+    for _ in range(repeats):
+        f().block_until_ready()
+    return (time.time() - start) / repeats
+
+def run(num_scenes=5, chunk_size=64):
+    mesh = trimesh.load(os.path.join(jax3dp3.utils.get_assets_dir(), "cube.obj"))
+    renderers = {}
+    for dtype in (jnp.float32, jnp.bfloat16, jnp.float16):
+        renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax", dtype=dtype)
+        renderer.load_model(mesh)
+        renderers[jnp.dtype(dtype).name] = renderer
+
+    key = jax.random.PRNGKey(0)
+    times = {name: 0.0 for name in renderers}
+    max_rank = {name: 0 for name in renderers}
+    max_error = {name: 0.0 for name in renderers}
+    max_error_range = {name: 0.0 for name in renderers}
+    for _ in range(num_scenes):
+        key, key_pose, key_noise = jax.random.split(key, 3)
+        center = jnp.array([0.0, 0.0, 4.0]) + jax.random.uniform(key_pose, (3,), minval=-0.5, maxval=0.5)
+        gt_pose = t3d.transform_from_pos(center).dot(
+            t3d.transform_from_axis_angle(jnp.array([0.0, 1.0, 0.0]), jax.random.uniform(key_pose, (), maxval=jnp.pi / 2))
+        )
+        obs = renderers["float32"].render_single_object(gt_pose, 0)
+        obs = obs.at[:,:,:3].add(0.005 * jax.random.normal(key_noise, (h, w, 3)) * obs[:,:,3:])
+        poses = make_proposals(center)
+
+        scores = {}
+        for name, renderer in renderers.items():
+            f = lambda: renderer.score_parallel(poses, 0, obs, r, outlier_prob, outlier_volume, chunk_size=chunk_size)
+            times[name] += time_fn(f) / num_scenes
+            scores[name] = f()
+        order = jnp.argsort(-scores["float32"])
+        for name in renderers:
+            best = jnp.argmax(scores[name])
+            max_rank[name] = max(max_rank[name], int(jnp.nonzero(order == best)[0][0]))
+            error = float(jnp.abs(scores[name] - scores["float32"]).max())
+            max_error[name] = max(max_error[name], error)
+            max_error_range[name] = max(max_error_range[name], error / float(jnp.ptp(scores["float32"])))
+
+    print(f"{poses.shape[0]} proposals per scene, {num_scenes} scenes, {h}x{w}")
+    print(f"{'dtype':>10} {'time (s)':>10} {'speedup':>8} {'max rank':>9} {'max err':>9} {'err/range':>10}")
+    for name in renderers:
+        print(f"{name:>10} {times[name]:>10.4f} {times['float32'] / times[name]:>7.2f}x {max_rank[name]:>9} {max_error[name]:>9.1f} {max_error_range[name]:>10.2e}")
+
+if __name__ == "__main__":
+    run()
@@ -43,9 +43,8 @@ model_dir = os.path.join(jax3dp3.utils.get_assets_dir(),"models")
 model_names = np.array(os.listdir(model_dir))
 model_box_dims = []
 for model in model_names:
-    mesh = trimesh.load(os.path.join(jax3dp3.utils.get_assets_dir(),"models/{}/textured_simple.obj".format(model)))
-    mesh = jax3dp3.mesh.center_mesh(mesh)
-    model_box_dims.append(jax3dp3.utils.axis_aligned_bounding_box(mesh.vertices)[0])
+    mesh = jax3dp3.model_cache.load_model_cached(os.path.join(jax3dp3.utils.get_assets_dir(),"models/{}/textured_simple.obj".format(model)))
+    model_box_dims.append(mesh.bbox_dims)
     jax3dp3.load_model(mesh)
 model_box_dims = jnp.array(model_box_dims)
 
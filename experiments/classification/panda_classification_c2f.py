@@ -2,8 +2,6 @@ import numpy as np
 import cv2
 import jax3dp3.transforms_3d as t3d
 import os
-import collections
-import heapq
 import jax
 import jax.numpy as jnp
 import trimesh
@@ -73,59 +71,7 @@ unique, counts =  np.unique(segmentation_img, return_counts=True)
 segmentation_idx_to_do_pose_estimation_for = unique[unique != -1]
 print(segmentation_idx_to_do_pose_estimation_for)
 
-poses_from_contact_params_sweep = jax.jit(jax.vmap(jax3dp3.scene_graph.pose_from_contact, in_axes=(0, None, 0, None, None, None)))
-scorer_parallel_jit = jax.jit(jax.vmap(jax3dp3.likelihood.threedp3_likelihood, in_axes=(None, 0, None, None, None)))
-    
-object_indices = list(range(len(model_names)))
-
-
-def coarse_to_fine_contact_params(
-    contact_param_sched, 
-    face_param_sched,
-    likelihood_r_sched,
-    init_latent_pose_table_frame,
-    gt_image_masked,
-    gt_img_complement,
-    top_k=5
-):
-    """
-    do coarse-to-fine, keeping the top top_k hypotheses at each round
-    """
-    num_steps = len(likelihood_r_sched)
-    latent_pose_cam_frame = t3d.inverse(t3d.inverse(table_pose).dot(cam_pose)) @ init_latent_pose_table_frame   
-    top_k_objs = collections.deque([(float('-inf'), obj_idx, latent_pose_cam_frame) for obj_idx in object_indices])  # start with all objects inference
-    
-    for sched_i in range(num_steps):
-        r = likelihood_r_sched[sched_i]
-
-        contact_param_sweep_delta, face_param_sweep = contact_param_sched[sched_i], face_param_sched[sched_i]
-                
-        for _ in range(len(top_k_objs)):
-            _, obj_idx, latent_pose_cam_frame = top_k_objs.popleft()
-
-            # get contact params
-            latent_pose_table_frame = t3d.inverse(table_pose).dot(cam_pose) @ latent_pose_cam_frame
-            c = latent_pose_table_frame[:3, 3]
-            contact_param_sweep = contact_param_sweep_delta + c  # shift center 
-
-            # get pose proposals in cam frame
-            pose_proposals = poses_from_contact_params_sweep(contact_param_sweep, table_face_param, face_param_sweep, table_dims, model_box_dims[obj_idx], table_pose)  
-
-            # get best pose proposal
-            images_unmasked = jax3dp3.render_parallel(pose_proposals, obj_idx)  # TODO multiobject parallelize
-            images = jax3dp3.renderer.get_complement_masked_images(images_unmasked, gt_img_complement)
-            weights = scorer_parallel_jit(gt_image_masked, images, r, 0.01, 20**3)
-            best_pose_idx = weights.argmax()
-
-            top_k_objs.append((weights[best_pose_idx], obj_idx, pose_proposals[best_pose_idx]))  
-
-        if sched_i == 0: 
-            top_k_objs = collections.deque(heapq.nlargest(top_k, top_k_objs))  # after the first iteration prune search down to the top_k top hypothesis objects 
-        
-        print(f"top {top_k} after {sched_i} iters:\n: {[(s, model_names[i]) for (s,i,p) in top_k_objs]}")
-    
-    return top_k_objs
-    
+scene = jax3dp3.coarse_to_fine.ContactScene(table_pose, table_dims, table_face_param, model_box_dims)
 
 
 def get_pose_estimation_for_segmentation(seg_id):
@@ -143,49 +89,25 @@ def get_pose_estimation_for_segmentation(seg_id):
     points_filtered = points_in_table_ref_frame[point_seg == jax3dp3.utils.get_largest_cluster_id_from_segmentation(point_seg)]
     center_x, center_y, _ = ( points_filtered.min(0) + points_filtered.max(0))/2
     
-    top_k = 5
-    # start = time.time() 
-
-    grid_width = 0.1
-    contact_param_sweep, face_param_sweep = jax3dp3.scene_graph.enumerate_contact_and_face_parameters(
-        -grid_width, -grid_width, 0.0, +grid_width, +grid_width, jnp.pi, 
-        5, 5, 5,
-        jnp.arange(6)
-    )
-
-    grid_width = 0.05
-    contact_param_sweep_2, face_param_sweep_2 = jax3dp3.scene_graph.enumerate_contact_and_face_parameters(
-        -grid_width, -grid_width, 0.0, +grid_width, +grid_width, jnp.pi*2, 
-        5, 5, 5,
-        jnp.arange(6)
-    )
+    gt_obs = jax3dp3.likelihood.prepare_observation(gt_image_masked)
 
-    grid_width = 0.02
-    contact_param_sweep_3, face_param_sweep_3 = jax3dp3.scene_graph.enumerate_contact_and_face_parameters(
-        -grid_width, -grid_width, 0.0, +grid_width, +grid_width, jnp.pi, 
-        5, 5, 5,
-        jnp.arange(6)
-    )
-    
-    contact_param_sched = [contact_param_sweep, contact_param_sweep_2, contact_param_sweep_3]
-    face_param_sched = [face_param_sweep, face_param_sweep_2, face_param_sweep_3]
-    likelihood_r_sched = [0.1, 0.05, 0.02]
+    top_k = 5
+    stages = [
+        jax3dp3.coarse_to_fine.make_stage(0.1, jnp.pi, 5, 5, jnp.arange(6), 0.1, top_k),
+        jax3dp3.coarse_to_fine.make_stage(0.05, jnp.pi*2, 5, 5, jnp.arange(6), 0.05, top_k),
+        jax3dp3.coarse_to_fine.make_stage(0.02, jnp.pi, 5, 5, jnp.arange(6), 0.02, top_k),
+    ]
     start = time.time()
-    top_k_heap = coarse_to_fine_contact_params(
-        contact_param_sched, face_param_sched, likelihood_r_sched=likelihood_r_sched,
-                                                                                        init_latent_pose_table_frame=t3d.transform_from_pos(jnp.array([center_x, center_y, 0])), 
-                                                                                        gt_image_masked=gt_image_masked, gt_img_complement=gt_img_complement,
-                                                                                        top_k=top_k)  
+    hypotheses = jax3dp3.coarse_to_fine.coarse_to_fine_contact_search(
+        jax3dp3.renderer.RENDERER, gt_obs, stages, scene, jnp.array([center_x, center_y, 0.0]),
+        complement=gt_img_complement, outlier_prob=0.01, outlier_volume=20**3,
+    )
     end= time.time()
     print ("Time elapsed:", end - start)
 
-
-    items = [item for item in heapq.nlargest(top_k, top_k_heap)]
-    all_scores = jnp.array([item[0] for item in items])
-    all_idxs = jnp.array([item[1] for item in items])
-    all_poses = jnp.array([item[2] for item in items])
-
-
+    all_scores = hypotheses.scores
+    all_idxs = hypotheses.model_indices
+    all_poses = hypotheses.poses
 
     order = np.argsort(-all_scores)
     best_idx = all_idxs[order[0]]
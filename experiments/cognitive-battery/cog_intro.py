@@ -8,6 +8,7 @@ import jax3dp3
 from scipy.spatial.transform import Rotation as R
 import jax3dp3.jax_rendering
 from PIL import Image
+import trimesh
 
 from tqdm import tqdm
 
@@ -80,6 +81,7 @@ seg_images = np.stack(seg_images)
 
 start_t = 10
 shape_planes, shape_dims, init_poses = [], [], []
+box_dims = []
 seg_img = seg_images[start_t][:, :, 2]
 
 imgs = []
@@ -100,6 +102,7 @@ for obj_id in jnp.unique(seg_img):
     
     init_pose = t3d.transform_from_pos(center_of_box)
     init_poses.append(init_pose)
+    box_dims.append(dims)
 
     shape, dim = jax3dp3.jax_rendering.get_rectangular_prism_shape(dims)
     shape_planes.append(shape)
@@ -137,17 +140,6 @@ r = 0.005
 outlier_prob = 0.01
 
 
-def likelihood(x, params):
-    obs= params[0]
-    rendered_image = jax3dp3.jax_rendering.render_planes_multiobject(x, shape_planes, shape_dims, height, width, fx,fy, cx,cy)
-    weight = jax3dp3.threedp3_likelihood(obs, rendered_image, r, outlier_prob)
-    return weight
-
-
-likelihood_parallel = jax.vmap(likelihood, in_axes=(0, None))
-likelihood_parallel_jit = jax.jit(likelihood_parallel)
-
-
 enumerations = jax3dp3.make_translation_grid_enumeration(-0.1, -0.1, -0.1, 0.1, 0.1, 0.1, 9, 9, 9)
 
 cm = plt.get_cmap("turbo")
@@ -156,27 +148,23 @@ middle_width = 20
 top_border = 100
 
 
-pose_estimates = init_poses.copy()
-
-inferred_poses = []
-batched_scorer_parallel_jit = jax.jit(lambda poses, image: jax3dp3.jax_rendering.batched_scorer_parallel_params(likelihood_parallel, 9, poses, (image,)))
+renderer = jax3dp3.Renderer(height, width, fx, fy, cx, cy, 0.01, 50.0, backend="jax")
+for dims in box_dims:
+    renderer.load_model(trimesh.creation.box(dims))
 
 num_steps = 2
-for t in tqdm(range(start_t, start_t+num_steps)):
-    gt_image = jnp.array(coord_images[t])
-    for i in range(pose_estimates.shape[0]):
-        enumerations_full = jnp.tile(
-            jnp.eye(4)[None, :, :],
-            (enumerations.shape[0], pose_estimates.shape[0], 1, 1),
-        )
-        enumerations_full = enumerations_full.at[:, i, :, :].set(enumerations)
-        proposals = jnp.einsum("bij,abjk->abik", pose_estimates, enumerations_full)
-
-        # print(proposals.shape)
-        weights = batched_scorer_parallel_jit(proposals, gt_image)
-        # print(weights.max())
-        pose_estimates = proposals[weights.argmax()]
-    inferred_poses.append(pose_estimates.copy())
+result = jax3dp3.tracking.block_gibbs_tracker(
+    renderer.render_function(),
+    jnp.arange(init_poses.shape[0]),
+    jnp.array(coord_images[start_t:start_t+num_steps]),
+    init_poses,
+    enumerations,
+    r,
+    outlier_prob,
+    1.0,
+    chunk_size=81,
+)
+inferred_poses = list(result.poses)
 
 
 all_images = []
@@ -99,12 +99,11 @@ enumeration_viz = jax3dp3.viz.get_depth_image(all_images_overlayed[:,:,2], max=f
 jax3dp3.viz.overlay_image(jax3dp3.viz.resize_image(rgb_viz, h,w), enumeration_viz).save("enumeration.png")
 
 
-images_unmasked = jax3dp3.render_parallel(poses, cube_mesh_id)
-image_combined_with_gt = jax.vmap(jax3dp3.combine_rendered_with_groud_truth, in_axes=(0, None))(images_unmasked, gt_image_full)
-scorer_parallel_jit = jax.jit(jax.vmap(jax3dp3.likelihood.threedp3_likelihood, in_axes=(None, 0, None, None, None)))
+# The observed scene is composited behind every proposal inside the likelihood.
+background = jax3dp3.prepare_background(gt_image_full)
 
 r = 0.0001
-weights = scorer_parallel_jit(gt_image_full, image_combined_with_gt, r, 0.001, 20**3)
+weights = jax3dp3.score_parallel(poses, cube_mesh_id, gt_image_full, r, 0.001, 20**3, background=background)
 
 best_weight = weights.max()
 good_scoring_indices = weights >= (best_weight)
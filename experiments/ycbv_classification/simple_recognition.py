@@ -14,8 +14,10 @@ cx,cy = 80.0, 60.0
 near=0.01
 far=50.0
 max_depth=2.0
+# "jax" runs without the GL plugin.
+backend = "gl"
 
-jax3dp3.setup_renderer(h, w, fx, fy, cx, cy, near, far)
+jax3dp3.setup_renderer(h, w, fx, fy, cx, cy, near, far, backend=backend)
 
 model_dir = os.path.join(jax3dp3.utils.get_assets_dir(),"models")
 model_names = os.listdir(model_dir)
@@ -35,10 +37,10 @@ gt_pose = sampler_jit(key, center_of_sampling, variance, concentration)
 gt_image = jax3dp3.render_single_object(gt_pose, gt_model_idx)
 jax3dp3.viz.save_depth_image(gt_image[:,:,2], "gt_image.png", max=max_depth)
 
-def scorer(rendered_image, gt, r, outlier_prob):
-    weight = jax3dp3.likelihood.threedp3_likelihood(gt, rendered_image, r, outlier_prob)
+def scorer(rendered_image, gt, r, outlier_prob, outlier_volume):
+    weight = jax3dp3.likelihood.threedp3_likelihood(gt, rendered_image, r, outlier_prob, outlier_volume)
     return weight
-scorer_parallel = jax.vmap(scorer, in_axes=(0, None, None, None))
+scorer_parallel = jax.vmap(scorer, in_axes=(0, None, None, None, None))
 scorer_parallel_jit = jax.jit(scorer_parallel)
 
 non_zero_points = gt_image[gt_image[:,:,2]>0,:3]
@@ -48,59 +50,23 @@ poses_to_score = jnp.einsum("ij,ajk->aik", centroid_pose, rotation_deltas)
 
 object_indices = list(range(len(model_names)))
 
-import jax.experimental.host_callback as hcb
-
-dummy = jnp.zeros((1000,h,w,4))
-
-def f(p, device):
-    return jnp.zeros((1000,h,w,4))
-
-_ret = jax3dp3.render_multi(poses_to_score,h,w,0)
-
-import numpy as np
-
-def rm_wrapper(poses_idx, device=None):
-    poses, idx = poses_idx
-    result = jax3dp3.render_multi(jnp.asarray(poses),h,w,idx)
-    return result
-# rm_wrapper((poses_to_score, 0))
-
-# def callback_renderer(poses_to_score, idx):
-#     return hcb.call(rm_wrapper, (poses_to_score, idx), result_shape=_ret, call_with_device=True)
-# callback_renderer_jit = jax.jit(callback_renderer)
-
-def callback_renderer(poses_to_score, idx):
-    return jax.pure_callback(rm_wrapper, 
-        jax.ShapeDtypeStruct((poses_to_score.shape[0],h,w,4),'float32'), 
-        (poses_to_score, idx))
-
-
-vmap_wrapper = jax.vmap(rm_wrapper, in_axes=((None, (0,)),))  # fails
-vmap_cbr = jax.vmap(callback_renderer, in_axes=(None,0))
-
-vmap_cbr_jit = jax.jit(vmap_cbr)
-
-
-from IPython import embed; embed()
-
-hcb.call(rm_wrapper, poses_to_score, 
-        result_shape=jax.ShapeDtypeStruct((1000,h,w,4), poses_to_score.dtype),call_with_device=True)
-
-
-ret = hcb.call(rm_wrapper, 
-        (poses_to_score, 0), 
-        result_shape=(poses_to_score.shape[0], h, w, 4, poses_to_score.dtype),
-        call_with_device=True)
-
-from IPython import embed; embed()
+# Renderer usable inside jit and vmap, so render -> likelihood -> argmax is one compiled function.
+# Poses are scored chunk_size at a time to bound the memory of the rendered batch.
+render = jax3dp3.renderer.RENDERER.render_function()
+chunk_size = 50
+def score_poses(poses, idx):
+    chunks, _ = jax3dp3.batched_scorer.pad_to_chunks(poses, chunk_size)
+    scores = jax.lax.map(lambda chunk: jax.vmap(lambda pose: scorer(render(pose, idx), gt_image, 0.01, 0.2, 1.0))(chunk), chunks)
+    return scores.reshape(-1)[:poses.shape[0]]
+score_poses_jit = jax.jit(score_poses)
 
 start= time.time()
 all_scores = [] 
 for idx in object_indices:
-    images = jax3dp3.render_parallel(poses_to_score, idx)
-    weights = scorer_parallel_jit(images, gt_image, 0.01, 0.2)
+    # Wait for the scores, also keeps the timing honest under async dispatch.
+    weights = np.asarray(score_poses_jit(poses_to_score, idx))
     best_pose_idx = weights.argmax()
-    jax3dp3.viz.save_depth_image(images[best_pose_idx,:,:,2], "imgs/best_{}.png".format(model_names[idx]), max=max_depth)
+    jax3dp3.viz.save_depth_image(jax3dp3.render_single_object(poses_to_score[best_pose_idx], idx)[:,:,2], "imgs/best_{}.png".format(model_names[idx]), max=max_depth)
     all_scores.append(weights[best_pose_idx])
 print(gt_mesh_name)
 print(model_names[np.argmax(all_scores)])
@@ -169,6 +169,7 @@ print(np.array(all_scores)[np.argsort(all_scores)])
 
 likelihood_r_range = [7.0] #[r for r in reversed(np.linspace(5, max_r,10))] + [r for r in reversed(np.linspace(1,5,10))] + [r for r in reversed(np.linspace(min_r,1,20))] 
 outlier_prob_range = [0.01] 
+sweep_scorer_jit = jax.jit(jax3dp3.likelihood.threedp3_likelihood_sweep)
 
 
 # Get the best CAMERA FRAME pose and score for a model given r and outlier_p parameter
@@ -180,9 +181,10 @@ def get_model_best_results(model_idx, r_range, outlier_prob_range):
     images_unmasked = jax3dp3.render_parallel(poses_to_score, model_idx)
     images_of_model = jax3dp3.renderer.get_masked_images(images_unmasked, gt_img_complement)
 
-    for r in r_range:
-        for outlier_prob in outlier_prob_range:
-            weights = scorer_parallel_jit(gt_img, images_of_model, r, outlier_prob, 10**3)
+    all_weights = sweep_scorer_jit(gt_img, images_of_model, jnp.array(r_range), jnp.array(outlier_prob_range), 10**3)
+    for (i, r) in enumerate(r_range):
+        for (j, outlier_prob) in enumerate(outlier_prob_range):
+            weights = all_weights[i, j]
             best_pose_idx = weights.argmax()
             
             best_pose = poses_to_score[best_pose_idx]
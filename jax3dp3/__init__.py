@@ -1,12 +1,50 @@
+import importlib
+
 from . import transforms_3d as t3d
-from . import viz
-from . import mesh
-from . import meshcat
-from . import utils
-from . import distributions
-from . import scene_graph
-from . import scene_graph
-from . import ycb_loader
 from .enumerations import *
-from .renderer import *
-from .likelihood import *
\ No newline at end of file
+from .likelihood import *
+
+# Everything else is imported on first access, so that a worker that only needs
+# transforms_3d and likelihood does not pay for torch, cv2, trimesh, matplotlib,
+# meshcat, tensorflow_probability or sklearn.
+_SUBMODULES = (
+    "batched_scorer",
+    "camera",
+    "coarse_to_fine",
+    "distributions",
+    "icp",
+    "incremental",
+    "jax_rendering",
+    "mesh",
+    "meshcat",
+    "model_cache",
+    "pose_grid",
+    "rasterizer",
+    "renderer",
+    "scene_graph",
+    "tracking",
+    "utils",
+    "viz",
+    "ycb_loader",
+)
+# Modules whose public names are also available as jax3dp3.<name>.
+_STAR_MODULES = ("renderer",)
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        # import_module also sets the attribute on the package.
+        return importlib.import_module(f".{name}", __name__)
+    if name.startswith("_"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    for module_name in _STAR_MODULES:
+        module = importlib.import_module(f".{module_name}", __name__)
+        if hasattr(module, name):
+            value = getattr(module, name)
+            # Module state such as renderer.RENDERER is looked up on every access.
+            if callable(value):
+                globals()[name] = value
+            return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
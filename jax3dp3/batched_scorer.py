@@ -0,0 +1,84 @@
+import functools
+import math
+import jax
+import jax.numpy as jnp
+
+# Score any number of proposals in fixed-size chunks. Proposals are padded to a
+# multiple of the chunk size with copies of the first proposal, the chunks are
+# scored with lax.map and the padding is dropped, so the proposal count never
+# constrains the split.
+
+DEFAULT_PROBE_SIZE = 16
+
+def num_proposals(proposals):
+    return jax.tree_util.tree_leaves(proposals)[0].shape[0]
+
+def pad_to_chunks(proposals, chunk_size):
+    """Reshape a pytree of proposals with leading dimension N into chunks.
+    Returns:
+        chunks: same pytree with leading dimensions (ceil(N / chunk_size), chunk_size)
+        valid: Array of shape (ceil(N / chunk_size), chunk_size), False for the padding
+    """
+    n = num_proposals(proposals)
+    num_pad = (-n) % chunk_size
+    def _pad(x):
+        x = jnp.concatenate([x, jnp.repeat(x[:1], num_pad, axis=0)])
+        return x.reshape(-1, chunk_size, *x.shape[1:])
+    valid = (jnp.arange(n + num_pad) < n).reshape(-1, chunk_size)
+    return jax.tree_util.tree_map(_pad, proposals), valid
+
+def bytes_per_proposal(scorer_parallel, proposals, *args, probe_size=DEFAULT_PROBE_SIZE):
+    """Device memory per proposal of scorer_parallel(proposals, *args), from the
+    compiled memory analysis of one probe chunk. Only shapes are used, so this
+    also works on traced values.
+    """
+    probe = jax.tree_util.tree_map(lambda x: jax.ShapeDtypeStruct((probe_size,) + x.shape[1:], x.dtype), proposals)
+    args = jax.tree_util.tree_map(lambda x: jax.ShapeDtypeStruct(jnp.shape(x), jnp.result_type(x)), args)
+    analysis = jax.jit(scorer_parallel).lower(probe, *args).compile().memory_analysis()
+    if analysis is None:
+        raise ValueError("This backend does not report memory usage; pass chunk_size instead of memory_budget")
+    total = analysis.temp_size_in_bytes + analysis.output_size_in_bytes
+    args_bytes = sum(math.prod(x.shape) * x.dtype.itemsize for x in jax.tree_util.tree_leaves(probe))
+    return max(1, math.ceil((total + args_bytes) / probe_size))
+
+def chunk_size_for_budget(scorer_parallel, proposals, memory_budget, *args, probe_size=DEFAULT_PROBE_SIZE):
+    """Largest chunk size whose scoring fits in memory_budget bytes, at most the
+    number of proposals and at least 1.
+    """
+    chunk_size = memory_budget // bytes_per_proposal(scorer_parallel, proposals, *args, probe_size=probe_size)
+    return int(max(1, min(chunk_size, num_proposals(proposals))))
+
+@functools.partial(jax.jit, static_argnums=(0,))
+def _map_chunks(scorer_parallel, chunks, args):
+    return jax.lax.map(lambda chunk: scorer_parallel(chunk, *args), chunks)
+
+def batched_scorer(scorer_parallel, proposals, *args, chunk_size=None, memory_budget=None):
+    """scorer_parallel(proposals, *args) computed chunk by chunk.
+    Args:
+        scorer_parallel: maps a chunk of proposals (a pytree with leading
+            dimension chunk_size) and *args to scores with leading dimension chunk_size
+        proposals: pytree with leading dimension N, any N
+        chunk_size (int): proposals per chunk. If None, chosen to fit memory_budget bytes.
+    Returns:
+        scores: Array with leading dimension N
+    """
+    n = num_proposals(proposals)
+    if chunk_size is None:
+        if memory_budget is None:
+            raise ValueError("Either chunk_size or memory_budget is required")
+        chunk_size = chunk_size_for_budget(scorer_parallel, proposals, memory_budget, *args)
+    chunk_size = min(chunk_size, n)
+    chunks, _ = pad_to_chunks(proposals, chunk_size)
+    scores = _map_chunks(scorer_parallel, chunks, args)
+    return jax.tree_util.tree_map(lambda x: x.reshape(-1, *x.shape[2:])[:n], scores)
+
+def batched_scorer_parallel(scorer_parallel, num_batches, proposals):
+    """Score proposals in num_batches chunks. Any number of proposals is
+    accepted, the last chunk is padded.
+    """
+    return batched_scorer(scorer_parallel, proposals, chunk_size=-(-num_proposals(proposals) // num_batches))
+
+def batched_scorer_parallel_params(scorer_parallel, num_batches, proposals, parameters):
+    return batched_scorer(
+        scorer_parallel, proposals, parameters, chunk_size=-(-num_proposals(proposals) // num_batches)
+    )
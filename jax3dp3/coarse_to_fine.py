@@ -0,0 +1,155 @@
+import functools
+from typing import NamedTuple
+import jax
+import jax.numpy as jnp
+import jax3dp3.rasterizer
+import jax3dp3.scene_graph
+from jax3dp3.batched_scorer import pad_to_chunks
+from jax3dp3.likelihood import Background, prepare_background, threedp3_likelihood
+
+# Coarse-to-fine search over object classes and contact poses on a table. Every
+# hypothesis is a model and the contact parameters of its best pose. A stage
+# sweeps contact parameter offsets around every hypothesis, keeps the best
+# proposal of each, then keeps the top_k hypotheses. All hypothesis state stays
+# on device between stages.
+
+class C2FStage(NamedTuple):
+    """One round of the search."""
+    contact_param_deltas: jnp.ndarray  # (S, 3) offsets added to the contact params of each hypothesis
+    faces: jnp.ndarray  # (S,) child face of each proposal
+    r: float
+    top_k: int  # hypotheses kept after this stage
+
+class Hypotheses(NamedTuple):
+    """K hypotheses, best first after a search."""
+    scores: jnp.ndarray  # (K,)
+    model_indices: jnp.ndarray  # (K,)
+    contact_params: jnp.ndarray  # (K, 3)
+    faces: jnp.ndarray  # (K,)
+    poses: jnp.ndarray  # (K, 4, 4) in the camera frame
+
+def make_stage(grid_width, angle_width, num_xy, num_angle, faces, r, top_k):
+    """Stage sweeping x, y in +-grid_width and angle in [0, angle_width] for every face."""
+    deltas, face_sweep = jax3dp3.scene_graph.enumerate_contact_and_face_parameters(
+        -grid_width, -grid_width, 0.0, grid_width, grid_width, angle_width,
+        num_xy, num_xy, num_angle, jnp.asarray(faces)
+    )
+    return C2FStage(deltas, face_sweep, r, top_k)
+
+class ContactScene(NamedTuple):
+    """Everything about the table contact that is fixed during a search."""
+    table_pose: jnp.ndarray  # (4, 4)
+    table_dims: jnp.ndarray  # (3,)
+    table_face: int
+    model_box_dims: jnp.ndarray  # (M, 3)
+
+def _proposal_poses(scene, model_idx, contact_params, faces):
+    return jax.vmap(jax3dp3.scene_graph.pose_from_contact, in_axes=(0, None, 0, None, None, None))(
+        contact_params, scene.table_face, faces, scene.table_dims, scene.model_box_dims[model_idx], scene.table_pose
+    )
+
+def _score_images(images, obs_xyz, background, r, outlier_prob, outlier_volume):
+    return jax.vmap(
+        lambda image: threedp3_likelihood(obs_xyz, image, r, outlier_prob, outlier_volume, background=background)
+    )(images)
+
+@functools.partial(jax.jit, static_argnames=("top_k", "chunk_size"))
+def _stage_jax(hypotheses, deltas, faces, r, triangles, rays, near, far, scene, obs_xyz, background, outlier_prob, outlier_volume, top_k, chunk_size):
+    def _score_model(model_idx, poses):
+        # One branch per model, lax.switch under lax.map only runs the taken branch.
+        branches = [
+            lambda p, tri=tri: jax3dp3.rasterizer.render_multiobject_parallel(p[:, None], [tri], rays, near, far)
+            for tri in triangles
+        ]
+        chunks, _ = pad_to_chunks(poses, chunk_size)
+        scores = jax.lax.map(
+            lambda p: _score_images(jax.lax.switch(model_idx, branches, p), obs_xyz, background, r, outlier_prob, outlier_volume),
+            chunks
+        )
+        return scores.reshape(-1)[:poses.shape[0]]
+
+    def _refine(hypothesis):
+        _, model_idx, contact_params, _, _ = hypothesis
+        proposal_params = contact_params + deltas
+        poses = _proposal_poses(scene, model_idx, proposal_params, faces)
+        scores = _score_model(model_idx, poses)
+        best = scores.argmax()
+        return Hypotheses(scores[best], model_idx, proposal_params[best], faces[best], poses[best])
+
+    refined = jax.lax.map(_refine, hypotheses)
+    top_scores, order = jax.lax.top_k(refined.scores, min(top_k, refined.scores.shape[0]))
+    return jax.tree_util.tree_map(lambda x: x[order], refined)
+
+@functools.partial(jax.jit, static_argnames=("renderer",))
+def _refine_gl(renderer, model_idx, contact_params, deltas, faces, r, scene, obs_xyz, background, outlier_prob, outlier_volume):
+    # Rendering goes through the callback of Renderer.render_function, so pose
+    # expansion, rendering and scoring of a hypothesis are one compiled call. r is
+    # traced, stages with the same sweep size share the compilation.
+    proposal_params = contact_params + deltas
+    poses = _proposal_poses(scene, model_idx, proposal_params, faces)
+    images = renderer.render_function(use_callback=True)(poses, model_idx)
+    scores = _score_images(images, obs_xyz, background, r, outlier_prob, outlier_volume)
+    best = scores.argmax()
+    return Hypotheses(scores[best], model_idx, proposal_params[best], faces[best], poses[best])
+
+def _stage_gl(renderer, hypotheses, stage, scene, obs_xyz, background, outlier_prob, outlier_volume):
+    refined = []
+    for k in range(hypotheses.scores.shape[0]):
+        # Wait before dispatching the next hypothesis, the callback may run jax
+        # itself (see Renderer.render_function).
+        refined.append(jax.block_until_ready(_refine_gl(
+            renderer, hypotheses.model_indices[k], hypotheses.contact_params[k], stage.contact_param_deltas, stage.faces, stage.r,
+            scene, obs_xyz, background, outlier_prob, outlier_volume
+        )))
+    refined = jax.tree_util.tree_map(lambda *x: jnp.stack(x), *refined)
+    _, order = jax.lax.top_k(refined.scores, min(stage.top_k, refined.scores.shape[0]))
+    return jax.tree_util.tree_map(lambda x: x[order], refined)
+
+def coarse_to_fine_contact_search(
+    renderer,
+    obs_xyz,
+    stages,
+    scene,
+    init_contact_params,
+    model_indices=None,
+    complement=None,
+    outlier_prob=0.01,
+    outlier_volume=1.0,
+    chunk_size=128,
+):
+    """Joint search over models and contact poses.
+    Args:
+        renderer (Renderer): renderer with the models loaded
+        obs_xyz: observed point cloud image or PreparedObservation
+        stages (list): C2FStage schedule
+        scene (ContactScene): table and model bounding boxes
+        init_contact_params (jnp.ndarray): Array of shape (3,), start of every hypothesis
+        model_indices: models to consider, all loaded models by default
+        complement (jnp.ndarray): point cloud image of the rest of the scene, occludes
+            the rendered proposals, see get_complement_masked_images. A Background from
+            prepare_background is used as is.
+    Returns:
+        hypotheses: Hypotheses with stages[-1].top_k entries, best first
+    """
+    if model_indices is None:
+        model_indices = jnp.arange(len(renderer.meshes))
+    model_indices = jnp.asarray(model_indices, dtype=jnp.int32)
+    num = model_indices.shape[0]
+    background = complement
+    if complement is not None and not isinstance(complement, Background):
+        background = prepare_background(complement, occlude_only=True)
+    hypotheses = Hypotheses(
+        jnp.full(num, -jnp.inf), model_indices, jnp.tile(jnp.asarray(init_contact_params), (num, 1)),
+        jnp.zeros(num, dtype=jnp.int32), jnp.tile(jnp.eye(4), (num, 1, 1)),
+    )
+    for stage in stages:
+        if renderer.backend == "jax":
+            hypotheses = _stage_jax(
+                hypotheses, stage.contact_param_deltas, stage.faces, stage.r,
+                tuple(renderer.triangles), renderer.rays, renderer.near, renderer.far,
+                scene, obs_xyz, background, outlier_prob, outlier_volume,
+                top_k=stage.top_k, chunk_size=min(chunk_size, stage.faces.shape[0]),
+            )
+        else:
+            hypotheses = _stage_gl(renderer, hypotheses, stage, scene, obs_xyz, background, outlier_prob, outlier_volume)
+    return hypotheses
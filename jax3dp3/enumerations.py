@@ -1,6 +1,95 @@
 import jax.numpy as jnp
 import jax
-from jax3dp3.transforms_3d import transform_from_axis_angle, transform_from_pos
+import numpy as np
+import collections
+import functools
+import hashlib
+import inspect
+import os
+import uuid
+from jax3dp3.transforms_3d import transform_from_axis_angle, transform_from_pos, rotation_matrix_to_quaternion
+
+# Enumerations decorated with cached_enumeration are memoized by their arguments,
+# in process and as .npy files in ENUMERATION_CACHE_DIR. Set it to None to keep
+# the cache in memory only. Files are keyed by ENUMERATION_CACHE_VERSION and the
+# source of the enumeration, bump the version when a helper it calls changes.
+ENUMERATION_CACHE_DIR = os.environ.get(
+    "JAX3DP3_ENUMERATION_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "jax3dp3", "enumerations")
+)
+ENUMERATION_CACHE_SIZE = 32
+ENUMERATION_CACHE_VERSION = 1
+ENUMERATIONS = {}
+_ENUMERATION_LRU = collections.OrderedDict()
+
+def _source_hash(fn):
+    try:
+        source = inspect.getsource(fn)
+    except (OSError, TypeError):
+        source = fn.__qualname__
+    return hashlib.sha1(source.encode()).hexdigest()[:12]
+
+def _cache_key(name, args):
+    key = [name]
+    for arg in args:
+        if isinstance(arg, jax.core.Tracer):
+            return None
+        arg = np.asarray(arg)
+        if arg.ndim > 0:
+            return None
+        key.append(repr(arg.item()))
+    return "-".join(key)
+
+def cached_enumeration(fn):
+    """Register `fn` in ENUMERATIONS and memoize it by its scalar arguments.
+    Calls with traced or array arguments are not cached. Cached calls are
+    evaluated eagerly, also inside jax.jit.
+    """
+    signature = inspect.signature(fn)
+    source_hash = _source_hash(fn)
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        args = bound.args
+        key = _cache_key(fn.__name__, args)
+        if key is None:
+            return fn(*args)
+        if key in _ENUMERATION_LRU:
+            _ENUMERATION_LRU.move_to_end(key)
+            return _ENUMERATION_LRU[key]
+
+        filename = None
+        if ENUMERATION_CACHE_DIR is not None:
+            file_key = f"{ENUMERATION_CACHE_VERSION}-{source_hash}-{key}"
+            filename = os.path.join(
+                ENUMERATION_CACHE_DIR, f"{fn.__name__}-{hashlib.sha1(file_key.encode()).hexdigest()}.npy"
+            )
+        if filename is not None and os.path.exists(filename):
+            value = jnp.asarray(np.load(filename))
+        else:
+            # Under jit fn would return a tracer, which can be neither saved nor reused.
+            with jax.ensure_compile_time_eval():
+                value = fn(*args)
+            if filename is not None:
+                os.makedirs(ENUMERATION_CACHE_DIR, exist_ok=True)
+                # Write and rename so concurrent runs never read a partial file. The
+                # file is created with mode 0666, so the umask applies as usual.
+                tmp_filename = f"{filename}.{uuid.uuid4().hex}.tmp"
+                fd = os.open(tmp_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, np.asarray(value))
+                os.replace(tmp_filename, filename)
+
+        _ENUMERATION_LRU[key] = value
+        if len(_ENUMERATION_LRU) > ENUMERATION_CACHE_SIZE:
+            _ENUMERATION_LRU.popitem(last=False)
+        return value
+    ENUMERATIONS[fn.__name__] = wrapper
+    return wrapper
+
+def clear_enumeration_cache():
+    """Clear the in process cache. Files in ENUMERATION_CACHE_DIR are kept."""
+    _ENUMERATION_LRU.clear()
 
 def angle_axis_helper_edgecase(newZ):
     zUnit = jnp.array([1.0, 0.0, 0.0])
@@ -45,13 +134,10 @@ def fibonacci_sphere(samples):
 
 
 def get_rotation_proposals(sample, rot_sample):
-    unit_sphere_directions = fibonacci_sphere(sample)
-    geodesicHopf_select_axis_vmap = jax.vmap(jax.vmap(geodesicHopf_select_axis, in_axes=(0,None)), in_axes=(None,0))
-    stepsize = 2*jnp.pi / rot_sample
-    rotation_proposals = geodesicHopf_select_axis_vmap(unit_sphere_directions, jnp.arange(0, 2*jnp.pi, stepsize)).reshape(-1, 4, 4)
-    return rotation_proposals
+    return make_rotation_grid_enumeration(sample, rot_sample)
 
 
+@cached_enumeration
 def make_rotation_grid_enumeration(fibonacci_sphere_points, num_planar_angle_points):
     unit_sphere_directions = fibonacci_sphere(fibonacci_sphere_points)
     geodesicHopf_select_axis_vmap = jax.vmap(jax.vmap(geodesicHopf_select_axis, in_axes=(0,None)), in_axes=(None,0))
@@ -59,6 +145,7 @@ def make_rotation_grid_enumeration(fibonacci_sphere_points, num_planar_angle_poi
     rotation_proposals = geodesicHopf_select_axis_vmap(unit_sphere_directions, jnp.arange(0, 2*jnp.pi, stepsize)).reshape(-1, 4, 4)
     return rotation_proposals
 
+@cached_enumeration
 def make_translation_grid_enumeration(min_x,min_y,min_z, max_x,max_y,max_z, num_x=2,num_y=2,num_z=2):
     deltas = jnp.stack(jnp.meshgrid(
         jnp.linspace(min_x, max_x, num_x),
@@ -90,9 +177,78 @@ def make_translation_grid_enumeration_2d(min_x,min_y, max_x, max_y, num_x,num_y)
 
 
 def make_grid_enumeration(min_x,min_y,min_z, max_x,max_y,max_z, num_x,num_y,num_z, fibonacci_sphere_points, num_planar_angle_points):
+    # Not cached itself, the full grid can be gigabytes. Its factors are cached
+    # and the product is a single einsum.
     rotations = make_rotation_grid_enumeration(fibonacci_sphere_points, num_planar_angle_points)
     translations = make_translation_grid_enumeration(min_x,min_y,min_z, max_x,max_y,max_z, num_x,num_y,num_z)
     all_proposals = jnp.einsum("aij,bjk->abik", rotations, translations).reshape(-1, 4, 4)
     return all_proposals
 
 
+def make_grid_enumeration_compact(min_x,min_y,min_z, max_x,max_y,max_z, num_x,num_y,num_z, fibonacci_sphere_points, num_planar_angle_points):
+    """make_grid_enumeration as compact poses, see transforms_3d.compact_to_pose.
+    Returns:
+        proposals: Array of shape (R*T, 7), in the order of make_grid_enumeration
+    """
+    rotations = make_rotation_grid_enumeration(fibonacci_sphere_points, num_planar_angle_points)[:, :3, :3]
+    translations = make_translation_grid_enumeration(min_x,min_y,min_z, max_x,max_y,max_z, num_x,num_y,num_z)[:, :3, 3]
+    quaternions = jax.vmap(rotation_matrix_to_quaternion)(rotations)
+    num_rotations, num_translations = rotations.shape[0], translations.shape[0]
+    return jnp.concatenate([
+        jnp.repeat(quaternions, num_translations, axis=0),
+        jnp.einsum("aij,bj->abi", rotations, translations).reshape(-1, 3),
+    ], axis=-1)
+
+
+# Streaming access to the proposals of make_grid_enumeration. Pose i of the grid
+# is rotations[i // T] @ translations[i % T] with T translations, the same order
+# as make_grid_enumeration, and chunks are computed on device from the indices.
+
+def grid_enumeration_poses(rotations, translations, indices):
+    num_translations = translations.shape[0]
+    return jnp.einsum("nij,njk->nik", rotations[indices // num_translations], translations[indices % num_translations])
+
+@functools.partial(jax.jit, static_argnames=("chunk_size",))
+def grid_enumeration_chunk(rotations, translations, start, chunk_size):
+    """Poses start ... start + chunk_size - 1 of the grid.
+    Returns:
+        poses: Array of shape (chunk_size, 4, 4), padded past the end of the grid
+        valid: Array of shape (chunk_size,), False for the padding
+    """
+    num_poses = rotations.shape[0] * translations.shape[0]
+    indices = start + jnp.arange(chunk_size)
+    valid = indices < num_poses
+    return grid_enumeration_poses(rotations, translations, jnp.where(valid, indices, 0)), valid
+
+def iter_grid_enumeration(rotations, translations, chunk_size):
+    """Yield (start, poses, valid) chunks of the rotation x translation grid.
+    Only one chunk of poses exists at a time, whatever the size of the grid.
+    """
+    num_poses = rotations.shape[0] * translations.shape[0]
+    for start in range(0, num_poses, chunk_size):
+        poses, valid = grid_enumeration_chunk(rotations, translations, start, chunk_size)
+        yield start, poses, valid
+
+@functools.partial(jax.jit, static_argnames=("top_k",))
+def _merge_top_k(top_scores, top_indices, scores, valid, start, top_k):
+    scores = jnp.concatenate([top_scores, jnp.where(valid, scores, -jnp.inf)])
+    indices = jnp.concatenate([top_indices, start + jnp.arange(valid.shape[0])])
+    top_scores, order = jax.lax.top_k(scores, top_k)
+    return top_scores, indices[order]
+
+def top_k_over_grid_enumeration(score_fn, rotations, translations, chunk_size, top_k):
+    """Best top_k poses of the rotation x translation grid, scored chunk by chunk.
+    Memory is independent of the size of the grid and nothing is copied to
+    the host between chunks.
+    Args:
+        score_fn: maps poses of shape (chunk_size, 4, 4) to scores of shape (chunk_size,)
+    Returns:
+        top_scores: Array of shape (top_k,), best first
+        top_indices: Array of shape (top_k,), grid indices of the best poses
+        top_poses: Array of shape (top_k, 4, 4)
+    """
+    top_scores = jnp.full(top_k, -jnp.inf)
+    top_indices = jnp.zeros(top_k, dtype=jnp.int32)
+    for start, poses, valid in iter_grid_enumeration(rotations, translations, chunk_size):
+        top_scores, top_indices = _merge_top_k(top_scores, top_indices, score_fn(poses), valid, start, top_k)
+    return top_scores, top_indices, grid_enumeration_poses(rotations, translations, top_indices)
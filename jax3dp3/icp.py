@@ -1,22 +1,58 @@
 import jax.numpy as jnp
-from jax3dp3.utils import extract_2d_patches
 from jax3dp3.transforms_3d import (
     transform_from_rot_and_pos
 )
+from jax3dp3.likelihood import observation_xyz_and_mask
 import jax
 import functools
+from typing import NamedTuple
 
 
 def get_nearest_neighbor(
     obs_xyz: jnp.ndarray,
     rendered_xyz: jnp.ndarray,
+    window=(10,10),
 ):
-    rendered_xyz_patches = extract_2d_patches(rendered_xyz, (10,10))
-    matches = find_closest_point_at_pixel(
-        obs_xyz,
-        rendered_xyz_patches,
-    )
-    return matches
+    """For every observed pixel, the rendered pixel whose point is closest to it
+    among the window centered at that pixel, with the window placement of
+    utils.extract_2d_patches. The window is scanned one offset at a time with a
+    running argmin, so memory stays O(H W) whatever the window size.
+    Args:
+        obs_xyz (jnp.ndarray): Array of shape (H, W, 3+)
+        rendered_xyz (jnp.ndarray): Array of shape (H, W, C), the first 3 channels are
+            searched and all C channels of the match are returned, e.g. points and normals.
+    Returns:
+        matches: Array of shape (H, W, C)
+    """
+    h, w = rendered_xyz.shape[:2]
+    top, left = window[0] // 2, window[1] // 2
+    padded = jnp.pad(rendered_xyz, ((top, window[0] - top - 1), (left, window[1] - left - 1), (0, 0)))
+    data_xyz = obs_xyz[:,:,:3]
+
+    def _offset(k, best):
+        best_distance, best_match = best
+        shifted = jax.lax.dynamic_slice(padded, (k // window[1], k % window[1], 0), rendered_xyz.shape)
+        distance = jnp.sum((data_xyz - shifted[:,:,:3])**2, axis=-1)
+        closer = distance < best_distance
+        return jnp.where(closer, distance, best_distance), jnp.where(closer[:,:,None], shifted, best_match)
+
+    init = (jnp.full((h, w), jnp.inf, dtype=rendered_xyz.dtype), jnp.zeros_like(rendered_xyz))
+    return jax.lax.fori_loop(0, window[0] * window[1], _offset, init)[1]
+
+def estimate_normals(xyz):
+    """Unit normals of a point cloud image from central differences, facing the
+    camera. Zero where a pixel or one of its 4 neighbours has no point.
+    """
+    points = xyz[:,:,:3]
+    padded = jnp.pad(points, ((1, 1), (1, 1), (0, 0)))
+    right, left = padded[1:-1, 2:], padded[1:-1, :-2]
+    down, up = padded[2:, 1:-1], padded[:-2, 1:-1]
+    normals = jnp.cross(right - left, down - up)
+    valid = (points[:,:,2] > 0) * (right[:,:,2] > 0) * (left[:,:,2] > 0) * (down[:,:,2] > 0) * (up[:,:,2] > 0)
+    norm = jnp.linalg.norm(normals, axis=-1, keepdims=True)
+    normals = normals / jnp.where(norm > 0, norm, 1.0)
+    normals = normals * jnp.where(jnp.sum(normals * points, axis=-1, keepdims=True) > 0, -1.0, 1.0)
+    return normals * (valid * (norm[:,:,0] > 0))[:,:,None]
 
 @functools.partial(
     jnp.vectorize,
@@ -54,17 +90,117 @@ def find_least_squares_transform_between_clouds(c1, c2, mask):
     transform =  transform_from_rot_and_pos(rot_final, T)
     return transform
 
-def icp(render_func, init_pose, obs_img, outer_iterations, inner_iterations):
+def find_point_to_plane_transform(source, target, target_normals, mask):
+    """Rigid transform that moves the source points onto the planes through the
+    target points, linearized in the rotation (one Gauss-Newton step).
+    Args:
+        source, target, target_normals (jnp.ndarray): Arrays of shape (N, 3)
+        mask (jnp.ndarray): Array of shape (N, 1)
+    """
+    A = jnp.concatenate([jnp.cross(source, target_normals), target_normals], axis=-1) * mask
+    b = -jnp.sum((source - target) * target_normals, axis=-1, keepdims=True) * mask
+    # Damping keeps directions the planes do not constrain, e.g. sliding along a
+    # single visible face, at zero instead of fitting noise.
+    AtA = A.T.dot(A)
+    damping = 1e-3 * jnp.trace(AtA) / 6 + 1e-9
+    x = jnp.linalg.solve(AtA + damping * jnp.eye(6), A.T.dot(b))[:,0]
+    omega = x[:3]
+    skew = jnp.array([
+        [0.0, -omega[2], omega[1]],
+        [omega[2], 0.0, -omega[0]],
+        [-omega[1], omega[0], 0.0],
+    ])
+    return transform_from_rot_and_pos(jax.scipy.linalg.expm(skew), x[3:])
+
+def icp_update(obs_xyz, obs_mask, rendered_img, window=(10,10), point_to_plane=False):
+    """Transform that moves rendered_img towards obs_xyz, after associating every
+    observed pixel with its nearest rendered point. For point_to_plane,
+    rendered_img carries the estimate_normals in channels 3:6.
+    """
+    neighbors = get_nearest_neighbor(obs_xyz, rendered_img, window)
+    mask = (neighbors[:,:,2] > 0) * obs_mask
+    c1 = neighbors[:,:,:3].reshape(-1,3)
+    c2 = obs_xyz[:,:,:3].reshape(-1,3)
+    if not point_to_plane:
+        return find_least_squares_transform_between_clouds(c1, c2, mask.reshape(-1,1))
+    normals = neighbors[:,:,3:6].reshape(-1,3)
+    mask = mask.reshape(-1,1) * (jnp.abs(normals).sum(axis=-1, keepdims=True) > 0)
+    # Move the observed points onto the rendered planes, then invert.
+    return jnp.linalg.inv(find_point_to_plane_transform(c2, c1, normals, mask))
+
+def _rendered_for_icp(render_func, pose, point_to_plane):
+    rendered_img = render_func(pose)[:,:,:3]
+    if point_to_plane:
+        rendered_img = jnp.concatenate([rendered_img, estimate_normals(rendered_img)], axis=-1)
+    return rendered_img
+
+def icp(render_func, init_pose, obs_img, outer_iterations, inner_iterations, window=(10,10), point_to_plane=False):
+    # obs_img is a point cloud image or a likelihood.PreparedObservation
+    obs_xyz, obs_mask = observation_xyz_and_mask(obs_img)
     def _icp_step(j, pose_):
-        rendered_img = render_func(pose_)
+        rendered_img = _rendered_for_icp(render_func, pose_, point_to_plane)
         def _icp_step_inner(i, pose):
-            neighbors = get_nearest_neighbor(obs_img, rendered_img)
-            mask = (neighbors[:,:,2] > 0)  * (obs_img[:,:,2] > 0)
-            c1 = neighbors[:,:,:3].reshape(-1,3)
-            c2 = obs_img[:,:,:3].reshape(-1,3)
-
-            transform = find_least_squares_transform_between_clouds(c1, c2, mask.reshape(-1,1))
+            transform = icp_update(obs_xyz, obs_mask, rendered_img, window, point_to_plane)
             pose = transform.dot(pose)
             return pose
         return jax.lax.fori_loop(0, inner_iterations, _icp_step_inner, pose_)
     return jax.lax.fori_loop(0, outer_iterations, _icp_step, init_pose)
+
+class ICPResult(NamedTuple):
+    poses: jnp.ndarray  # (K, 4, 4)
+    iterations: jnp.ndarray  # (K,) outer iterations used by each hypothesis
+    converged: jnp.ndarray  # (K,) whether the last update was below tolerance
+
+def transform_magnitude(transform):
+    """Translation norm and rotation angle of a (4, 4) rigid transform."""
+    cos_angle = (jnp.trace(transform[:3,:3]) - 1.0) / 2.0
+    return jnp.linalg.norm(transform[:3,3]), jnp.arccos(jnp.clip(cos_angle, -1.0, 1.0))
+
+def icp_parallel(
+    render_func,
+    init_poses,
+    obs_img,
+    max_iterations,
+    inner_iterations=1,
+    translation_tolerance=1e-4,
+    rotation_tolerance=1e-3,
+    window=(10,10),
+    point_to_plane=False,
+):
+    """icp on K hypotheses at once, e.g. the top_k poses of a sweep.
+    A hypothesis is frozen once an outer iteration moves it by less than both
+    tolerances, and the loop stops as soon as every hypothesis is frozen.
+    Args:
+        render_func: maps a (4, 4) pose to a point cloud image, must support vmap
+        init_poses (jnp.ndarray): Array of shape (K, 4, 4)
+        obs_img: point cloud image or likelihood.PreparedObservation
+        window, point_to_plane: see icp_update
+    Returns:
+        ICPResult
+    """
+    obs_xyz, obs_mask = observation_xyz_and_mask(obs_img)
+
+    def _step(pose_):
+        rendered_img = _rendered_for_icp(render_func, pose_, point_to_plane)
+        def _icp_step_inner(i, pose):
+            return icp_update(obs_xyz, obs_mask, rendered_img, window, point_to_plane).dot(pose)
+        return jax.lax.fori_loop(0, inner_iterations, _icp_step_inner, pose_)
+
+    def _cond(state):
+        _, _, active, iteration = state
+        return jnp.any(active) * (iteration < max_iterations)
+
+    def _body(state):
+        poses, iterations, active, iteration = state
+        new_poses = jax.vmap(_step)(poses)
+        translation, angle = jax.vmap(lambda new, old: transform_magnitude(new.dot(jnp.linalg.inv(old))))(new_poses, poses)
+        poses = jnp.where(active[:, None, None], new_poses, poses)
+        iterations = iterations + active
+        active = active * ((translation >= translation_tolerance) | (angle >= rotation_tolerance))
+        return poses, iterations, active, iteration + 1
+
+    num = init_poses.shape[0]
+    poses, iterations, active, _ = jax.lax.while_loop(
+        _cond, _body, (init_poses, jnp.zeros(num, dtype=jnp.int32), jnp.ones(num, dtype=bool), 0)
+    )
+    return ICPResult(poses, iterations, ~active)
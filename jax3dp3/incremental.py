@@ -0,0 +1,137 @@
+from typing import NamedTuple
+import jax
+import jax.numpy as jnp
+from jax3dp3.likelihood import (
+    coordinate_planes, count_neighbors_planes, log_likelihood_from_count_histogram,
+    mask_bbox, observation_planes_and_mask,
+)
+from jax3dp3.rasterizer import composite_point_cloud_images
+
+# Incremental 3DP3 likelihood for scenes where a single object moves. The rest
+# of the scene, the per-pixel neighbour counts and a histogram of those counts
+# over the observed pixels are cached. Moving the object only changes counts
+# within filter_size of the union of its old and new screen-space footprints,
+# so only a static-size window around that union is recomputed. The likelihood
+# depends on the counts only through the histogram and the number of rendered
+# points, both of which are updated from the window.
+
+class IncrementalScene(NamedTuple):
+    """Cached state of a scene with one moving object, for a fixed r."""
+    rest: jnp.ndarray  # (H + 2f, W + 2f, 4) everything but the moving object, padded
+    scene: jnp.ndarray  # (H + 2f, W + 2f, 4) rest composited with the object, padded
+    counts: jnp.ndarray  # (H, W) neighbour counts of every observed pixel
+    count_histogram: jnp.ndarray  # ((2f + 1)^2 + 1,) observed pixels with each count
+    num_latent_points: jnp.ndarray  # () rendered points in the scene
+    footprint: jnp.ndarray  # (4,) bounding box of the object, see mask_bbox
+
+    @property
+    def filter_size(self):
+        return (self.scene.shape[0] - self.counts.shape[0]) // 2
+
+def _pad_image(image, filter_size):
+    # Points outside the image are far away, like pad_planes, and never hit.
+    padded = jnp.pad(image, ((filter_size, filter_size), (filter_size, filter_size), (0, 0)))
+    inside = jnp.pad(jnp.ones(image.shape[:2], dtype=bool), filter_size)
+    return padded.at[:, :, :3].set(jnp.where(inside[:, :, None], padded[:, :, :3], -100.0))
+
+def _count_histogram(counts, obs_mask, filter_size):
+    length = (2 * filter_size + 1)**2 + 1
+    return jnp.bincount(counts.ravel(), weights=obs_mask.ravel().astype(jnp.int32), length=length).astype(jnp.int32)
+
+def _full_scene(obs_planes, obs_mask, rest, object_xyz, r, filter_size):
+    h, w = obs_mask.shape
+    scene = composite_point_cloud_images(_pad_image(object_xyz, filter_size), rest)
+    counts = count_neighbors_planes(obs_planes, coordinate_planes(scene), r, filter_size)
+    return IncrementalScene(
+        rest, scene, counts, _count_histogram(counts, obs_mask, filter_size),
+        (scene[filter_size:filter_size+h, filter_size:filter_size+w, 2] > 0.0).sum(),
+        mask_bbox(object_xyz[:, :, 2] > 0.0),
+    )
+
+def _window_scene(obs_planes, obs_mask, state, object_xyz, r, window):
+    f = state.filter_size
+    h, w = obs_mask.shape
+    wh, ww = min(window[0], h), min(window[1], w)
+    footprint = mask_bbox(object_xyz[:, :, 2] > 0.0)
+    # Counts change within f of a pixel whose rendered point changed.
+    rmin = jnp.maximum(jnp.minimum(footprint[0], state.footprint[0]) - f, 0)
+    rmax = jnp.minimum(jnp.maximum(footprint[1], state.footprint[1]) + f, h - 1)
+    cmin = jnp.maximum(jnp.minimum(footprint[2], state.footprint[2]) - f, 0)
+    cmax = jnp.minimum(jnp.maximum(footprint[3], state.footprint[3]) + f, w - 1)
+    fits = (rmax - rmin < wh) & (cmax - cmin < ww)
+    r0, c0 = jnp.minimum(rmin, h - wh), jnp.minimum(cmin, w - ww)
+
+    object_crop = jax.lax.dynamic_slice(
+        jnp.pad(object_xyz, ((f, f), (f, f), (0, 0))), (r0, c0, 0), (wh + 2*f, ww + 2*f, object_xyz.shape[2])
+    )
+    rest_crop = jax.lax.dynamic_slice(state.rest, (r0, c0, 0), (wh + 2*f, ww + 2*f, state.rest.shape[2]))
+    scene_crop = composite_point_cloud_images(object_crop, rest_crop)
+    scene_core = scene_crop[f:f+wh, f:f+ww]
+    old_scene_core = jax.lax.dynamic_slice(state.scene, (r0 + f, c0 + f, 0), scene_core.shape)
+
+    obs_mask_crop = jax.lax.dynamic_slice(obs_mask, (r0, c0), (wh, ww))
+    counts_crop = count_neighbors_planes(
+        jax.lax.dynamic_slice(obs_planes, (0, r0, c0), (3, wh, ww)), coordinate_planes(scene_crop), r, f
+    )
+    old_counts_crop = jax.lax.dynamic_slice(state.counts, (r0, c0), (wh, ww))
+    state = IncrementalScene(
+        state.rest,
+        jax.lax.dynamic_update_slice(state.scene, scene_core, (r0 + f, c0 + f, 0)),
+        jax.lax.dynamic_update_slice(state.counts, counts_crop, (r0, c0)),
+        state.count_histogram + _count_histogram(counts_crop, obs_mask_crop, f) - _count_histogram(old_counts_crop, obs_mask_crop, f),
+        state.num_latent_points + (scene_core[:, :, 2] > 0.0).sum() - (old_scene_core[:, :, 2] > 0.0).sum(),
+        footprint,
+    )
+    return fits, state
+
+def make_incremental_scene(obs_xyz, rest_xyz, object_xyz, r, filter_size=3):
+    """Cache for scoring moves of one object in front of or behind rest_xyz.
+    Args:
+        obs_xyz: observed point cloud image or PreparedObservation
+        rest_xyz (jnp.ndarray): Array of shape (H, W, 4), the other objects and any
+            static background composited into one point cloud image
+        object_xyz (jnp.ndarray): Array of shape (H, W, 4), the moving object alone
+        r: the radius every later call scores with
+    """
+    obs_planes, obs_mask = observation_planes_and_mask(obs_xyz)
+    return _full_scene(obs_planes, obs_mask, _pad_image(rest_xyz, filter_size), object_xyz, r, filter_size)
+
+def update_incremental_scene(obs_xyz, state, object_xyz, r, window):
+    """State with the moving object replaced by object_xyz. Only a window of
+    static shape window = (rows, cols) is recomputed, unless the union of the old
+    and new footprints grown by filter_size does not fit in it.
+    """
+    obs_planes, obs_mask = observation_planes_and_mask(obs_xyz)
+    f = state.filter_size
+    fits, windowed = _window_scene(obs_planes, obs_mask, state, object_xyz, r, window)
+    return jax.lax.cond(
+        fits,
+        lambda: windowed,
+        lambda: _full_scene(obs_planes, obs_mask, state.rest, object_xyz, r, f),
+    )
+
+def incremental_likelihood(obs_xyz, state, object_xyz, r, outlier_prob, outlier_volume, window):
+    """threedp3_likelihood of the scene with the moving object replaced by
+    object_xyz, see update_incremental_scene. Use incremental_likelihood_parallel
+    for batches, under vmap the fallback would always be computed.
+    """
+    state = update_incremental_scene(obs_xyz, state, object_xyz, r, window)
+    return log_likelihood_from_count_histogram(state.count_histogram, state.num_latent_points, r, outlier_prob, outlier_volume)
+
+def incremental_likelihood_parallel(obs_xyz, state, object_xyz, r, outlier_prob, outlier_volume, window):
+    """incremental_likelihood of every image in object_xyz of shape (N, H, W, 4).
+    Falls back to full images for the whole batch if any proposal leaves the window.
+    """
+    obs_planes, obs_mask = observation_planes_and_mask(obs_xyz)
+    f = state.filter_size
+    fits, windowed = jax.vmap(lambda image: _window_scene(obs_planes, obs_mask, state, image, r, window))(object_xyz)
+    histograms, num_latent_points = jax.lax.cond(
+        fits.all(),
+        lambda: (windowed.count_histogram, windowed.num_latent_points),
+        lambda: jax.vmap(
+            lambda image: _full_scene(obs_planes, obs_mask, state.rest, image, r, f)[3:5]
+        )(object_xyz),
+    )
+    return jax.vmap(log_likelihood_from_count_histogram, in_axes=(0, 0, None, None, None))(
+        histograms, num_latent_points, r, outlier_prob, outlier_volume
+    )
@@ -3,6 +3,7 @@ import jax
 import numpy as np
 import functools
 from functools import partial
+from typing import NamedTuple
 
 @functools.partial(
     jnp.vectorize,
@@ -20,6 +21,166 @@ def count_ii_jj(
     distance = jnp.linalg.norm(t, axis=-1).ravel() # (4,4)
     return jnp.sum(distance <= r)
 
+def coordinate_planes(xyz):
+    # (H, W, 3+) image to (3, H, W) planes, so every window comparison is a dense 2D op.
+    return jnp.moveaxis(xyz[:,:,:3], -1, 0)
+
+def pad_planes(planes, filter_size):
+    return jax.lax.pad(planes, jnp.array(-100.0, dtype=planes.dtype), ((0,0,0,),(filter_size,filter_size,0,),(filter_size,filter_size,0,)))
+
+def count_neighbors_planes(data_planes, model_planes_padded, r, filter_size):
+    # model_planes_padded may be padded by more than filter_size.
+    h, w = data_planes.shape[1:]
+    offset = (model_planes_padded.shape[1] - h) // 2 - filter_size
+    if offset < 0:
+        raise ValueError(f"Planes are padded for a filter size smaller than {filter_size}")
+    # Distances are computed in the dtype of the planes, counts are always int32.
+    r_squared = (jnp.asarray(r, dtype=data_planes.dtype)**2)[..., None, None]
+    counts = jnp.zeros(r_squared.shape[:-2] + (h, w), dtype=jnp.int32)
+    for i in range(offset, offset + 2*filter_size + 1):
+        for j in range(offset, offset + 2*filter_size + 1):
+            shifted = model_planes_padded[:, i:i+h, j:j+w]
+            distance_squared = (
+                (data_planes[0] - shifted[0])**2 +
+                (data_planes[1] - shifted[1])**2 +
+                (data_planes[2] - shifted[2])**2
+            )
+            counts += distance_squared <= r_squared
+    return counts
+
+def low_precision_planes(obs_planes, obs_mask, rendered_planes, dtype):
+    """Recenter observed and rendered planes on the observed centroid and cast them
+    to `dtype` (e.g. jnp.bfloat16 or jnp.float16). Distances only depend on
+    differences, and small coordinates keep enough precision to resolve r.
+    """
+    obs_planes = obs_planes.astype(jnp.float32)
+    num_points = jnp.maximum(obs_mask.sum(), 1)
+    center = (jnp.sum(obs_planes * obs_mask, axis=(1, 2)) / num_points)[:, None, None]
+    return (
+        (obs_planes - center).astype(dtype),
+        (rendered_planes.astype(jnp.float32) - center).astype(dtype),
+    )
+
+def count_neighbors(
+    data_xyz: jnp.ndarray,
+    model_xyz: jnp.ndarray,
+    r,
+    filter_size: int,
+):
+    """For each pixel of data_xyz, count the points of model_xyz within distance r
+    in the (2*filter_size+1)^2 window centered at that pixel.
+    Same result as count_ii_jj, computed as one whole-image comparison per window
+    offset instead of a per-pixel gather.
+    Args:
+        data_xyz (jnp.ndarray): Array of shape (H, W, 3+)
+        model_xyz (jnp.ndarray): Array of shape (H, W, 3+)
+        r: scalar or array of radii.
+    Returns:
+        counts: Array of shape r.shape + (H, W)
+    """
+    return count_neighbors_planes(
+        coordinate_planes(data_xyz), pad_planes(coordinate_planes(model_xyz), filter_size), r, filter_size
+    )
+
+
+class SparseObservation(NamedTuple):
+    """Valid observed pixels compacted into a fixed capacity list.
+    Entries past the number of valid pixels are padding with valid == False.
+    """
+    points: jnp.ndarray  # (C, 3)
+    rows: jnp.ndarray  # (C,)
+    cols: jnp.ndarray  # (C,)
+    valid: jnp.ndarray  # (C,)
+
+def make_sparse_observation(obs_xyz, capacity=None):
+    """Compact the pixels of obs_xyz with z > 0.
+    capacity must be given when called under jit. Pixels past capacity are dropped.
+    """
+    mask = obs_xyz[:,:,2] > 0.0
+    if capacity is None:
+        capacity = max(int(mask.sum()), 1)
+    rows, cols = jnp.nonzero(mask, size=capacity, fill_value=0)
+    valid = jnp.arange(capacity) < mask.sum()
+    points = obs_xyz[rows, cols, :3] * valid[:, None]
+    return SparseObservation(points, rows, cols, valid)
+
+
+class PreparedObservation(NamedTuple):
+    """Everything about an observed point cloud image that does not depend on the
+    proposal being scored. Build it once with prepare_observation and pass it
+    in place of obs_xyz to the likelihood and ICP functions.
+    """
+    xyz: jnp.ndarray  # (H, W, 3)
+    planes: jnp.ndarray  # (3, H, W)
+    mask: jnp.ndarray  # (H, W)
+    num_points: jnp.ndarray  # ()
+    bbox: jnp.ndarray  # (4,) min row, max row, min col, max col of the valid pixels
+    sparse: SparseObservation  # None unless prepare_observation was given a capacity
+
+def mask_bbox(mask):
+    """min row, max row, min col, max col of the True pixels of an (H, W) mask.
+    An empty mask gives the whole image.
+    """
+    any_rows = jnp.any(mask, axis=1)
+    any_cols = jnp.any(mask, axis=0)
+    return jnp.array([
+        jnp.argmax(any_rows), mask.shape[0] - 1 - jnp.argmax(any_rows[::-1]),
+        jnp.argmax(any_cols), mask.shape[1] - 1 - jnp.argmax(any_cols[::-1]),
+    ])
+
+def prepare_observation(obs_xyz, capacity=None):
+    """Precompute planes, masks and bounding box of obs_xyz. With a capacity the
+    valid pixel list for the sparse likelihoods is built too, see
+    make_sparse_observation. Shapes only depend on the image size and capacity,
+    so observations of different segments share compilations.
+    """
+    xyz = obs_xyz[:,:,:3]
+    planes = coordinate_planes(xyz)
+    mask = xyz[:,:,2] > 0.0
+    sparse = None if capacity is None else make_sparse_observation(xyz, capacity)
+    return PreparedObservation(xyz, planes, mask, mask.sum(), mask_bbox(mask), sparse)
+
+def _sparse_observation(obs):
+    if isinstance(obs, PreparedObservation):
+        if obs.sparse is None:
+            raise ValueError("Sparse likelihoods need prepare_observation(obs_xyz, capacity)")
+        return obs.sparse
+    return obs
+
+def observation_planes_and_mask(obs_xyz):
+    if isinstance(obs_xyz, PreparedObservation):
+        return obs_xyz.planes, obs_xyz.mask
+    return coordinate_planes(obs_xyz), obs_xyz[:,:,2] > 0.0
+
+def observation_xyz_and_mask(obs_xyz):
+    if isinstance(obs_xyz, PreparedObservation):
+        return obs_xyz.xyz, obs_xyz.mask
+    return obs_xyz[:,:,:3], obs_xyz[:,:,2] > 0.0
+
+
+class Background(NamedTuple):
+    """Static content composited behind every rendered image while scoring, see
+    prepare_background.
+    """
+    planes: jnp.ndarray  # (3, H, W) background points, zero where they do not count
+    depth: jnp.ndarray  # (H, W) depth that occludes rendered points, zero where empty
+
+def prepare_background(background_xyz, occlude_only=False):
+    """Background for threedp3_likelihood from a point cloud image, e.g. a table
+    and fixed objects rendered once, or the observed complement of the object.
+    Rendered points at or behind a background point are replaced by it, as in
+    combine_rendered_with_groud_truth. With occlude_only, they are removed and
+    the background contributes no points, as in get_complement_masked_images.
+    """
+    planes = coordinate_planes(background_xyz)
+    if occlude_only:
+        planes = jnp.zeros_like(planes)
+    return Background(planes, background_xyz[:,:,2])
+
+def composite_background_planes(rendered_planes, background):
+    """Planes of the rendered image z-composited with background."""
+    in_front = (rendered_planes[2] > 0.0) * ((background.depth == 0.0) | (rendered_planes[2] < background.depth))
+    return rendered_planes * in_front + background.planes.astype(rendered_planes.dtype) * (1 - in_front)
 
 def threedp3_likelihood(
     obs_xyz: jnp.ndarray,
@@ -27,43 +188,212 @@ def threedp3_likelihood(
     r,
     outlier_prob,
     outlier_volume,
+    filter_size=3,
+    dtype=None,
+    background=None,
 ):
-    filter_size = 3
-    obs_mask = obs_xyz[:,:,2] > 0.0
-    rendered_mask = rendered_xyz[:,:,2] > 0.0
-    rendered_xyz_padded = jax.lax.pad(rendered_xyz,  -100.0, ((filter_size,filter_size,0,),(filter_size,filter_size,0,),(0,0,0,)))
-    jj, ii = jnp.meshgrid(jnp.arange(obs_xyz.shape[1]), jnp.arange(obs_xyz.shape[0]))
-    indices = jnp.stack([ii,jj],axis=-1)
-    counts = count_ii_jj(indices, obs_xyz, rendered_xyz_padded, r, filter_size)
-    num_latent_points = rendered_mask.sum()
+    """3DP3 likelihood of an observed point cloud image given a rendered one.
+    dtype (e.g. jnp.bfloat16) computes the window distances in reduced precision,
+    see low_precision_planes. Counts and the log likelihood stay int32/float32.
+    background (Background) is composited behind the rendered image per pixel
+    inside the kernel, without building composited images.
+    """
+    obs_planes, obs_mask = observation_planes_and_mask(obs_xyz)
+    rendered_planes = coordinate_planes(rendered_xyz)
+    if background is not None:
+        rendered_planes = composite_background_planes(rendered_planes, background)
+    rendered_mask = rendered_planes[2] > 0.0
+    if dtype is not None:
+        obs_planes, rendered_planes = low_precision_planes(obs_planes, obs_mask, rendered_planes, dtype)
+    counts = count_neighbors_planes(obs_planes, pad_planes(rendered_planes, filter_size), r, filter_size)
+    return log_likelihood_from_counts(counts, obs_mask, rendered_mask.sum(), r, outlier_prob, outlier_volume)
+
+def log_probs_from_counts(counts, num_latent_points, r, outlier_prob, outlier_volume):
     any_points = num_latent_points > 0
     probs = (
         any_points * jnp.nan_to_num(outlier_prob * (1.0 / outlier_volume) +  ((1.0 - outlier_prob) / num_latent_points  * 1.0 / (4/3 * jnp.pi * r**3) * counts ) )
         +
         (1- any_points) * (1.0 / outlier_volume + 0.0 * counts)
     )
-    log_probs = jnp.log(probs)
+    return jnp.log(probs)
+
+def log_likelihood_from_counts(counts, obs_mask, num_latent_points, r, outlier_prob, outlier_volume):
+    log_probs = log_probs_from_counts(counts, num_latent_points, r, outlier_prob, outlier_volume)
     return jnp.sum(jnp.where(obs_mask, log_probs, 0.0))
 
+def log_likelihood_from_count_histogram(count_histogram, num_latent_points, r, outlier_prob, outlier_volume):
+    """log_likelihood_from_counts from the number of observed pixels with each
+    count, count_histogram[c], instead of the per-pixel counts.
+    """
+    log_probs = log_probs_from_counts(
+        jnp.arange(count_histogram.shape[0]), num_latent_points, r, outlier_prob, outlier_volume
+    )
+    return jnp.sum(jnp.where(count_histogram > 0, count_histogram * log_probs, 0.0))
+
+def threedp3_likelihood_multi_r(
+    obs_xyz: jnp.ndarray,
+    rendered_xyz: jnp.ndarray,
+    r_array,
+    outlier_prob_array,
+    outlier_volume,
+    filter_size=3,
+    dtype=None,
+):
+    """threedp3_likelihood for every (r, outlier_prob) pair, computing the window
+    distances once and reusing them for every pair.
+    Returns:
+        scores: Array of shape (num_r, num_outlier_prob)
+    """
+    obs_planes, obs_mask = observation_planes_and_mask(obs_xyz)
+    num_latent_points = (rendered_xyz[:,:,2] > 0.0).sum()
+    rendered_planes = coordinate_planes(rendered_xyz)
+    if dtype is not None:
+        obs_planes, rendered_planes = low_precision_planes(obs_planes, obs_mask, rendered_planes, dtype)
+    counts = count_neighbors_planes(obs_planes, pad_planes(rendered_planes, filter_size), r_array, filter_size)
+    return jax.vmap(
+        jax.vmap(log_likelihood_from_counts, in_axes=(None, None, None, None, 0, None)),
+        in_axes=(0, None, None, 0, None, None)
+    )(counts, obs_mask, num_latent_points, r_array, outlier_prob_array, outlier_volume)
+
+def threedp3_likelihood_sweep(
+    obs_xyz: jnp.ndarray,
+    rendered_xyz: jnp.ndarray,
+    r_array,
+    outlier_prob_array,
+    outlier_volume,
+    filter_size=3,
+    dtype=None,
+):
+    """Hyperparameter sweep of threedp3_likelihood over a batch of rendered images.
+    Args:
+        obs_xyz (jnp.ndarray): Array of shape (H, W, 3+)
+        rendered_xyz (jnp.ndarray): Array of shape (N, H, W, 3+)
+        r_array (jnp.ndarray): Array of shape (num_r,)
+        outlier_prob_array (jnp.ndarray): Array of shape (num_outlier_prob,)
+    Returns:
+        scores: Array of shape (num_r, num_outlier_prob, N)
+    """
+    scores = jax.vmap(
+        lambda rendered: threedp3_likelihood_multi_r(obs_xyz, rendered, jnp.asarray(r_array), jnp.asarray(outlier_prob_array), outlier_volume, filter_size, dtype)
+    )(rendered_xyz)
+    return jnp.moveaxis(scores, 0, -1)
+
+
+threedp3_likelihood_parallel = jax.vmap(threedp3_likelihood, in_axes=(None, 0, None, None, None))
+threedp3_likelihood_parallel_jit = jax.jit(threedp3_likelihood_parallel)
+
+
+def count_neighbors_sparse(
+    sparse_obs: SparseObservation,
+    model_xyz: jnp.ndarray,
+    r,
+    filter_size: int,
+):
+    """count_neighbors evaluated only at the pixels of sparse_obs.
+    Returns:
+        counts: Array of shape (C,)
+    """
+    sparse_obs = _sparse_observation(sparse_obs)
+    # Gather from the unpadded coordinate planes. Out of bounds neighbours never
+    # count, like the -100.0 padding of count_neighbors.
+    h, w = model_xyz.shape[:2]
+    model_planes_flat = jnp.moveaxis(model_xyz[:,:,:3], -1, 0).reshape(3, h * w)
+    data_planes = sparse_obs.points.T
+    counts = jnp.zeros(sparse_obs.rows.shape, dtype=jnp.int32)
+    for i in range(-filter_size, filter_size + 1):
+        for j in range(-filter_size, filter_size + 1):
+            rows = sparse_obs.rows + i
+            cols = sparse_obs.cols + j
+            in_bounds = (rows >= 0) * (rows < h) * (cols >= 0) * (cols < w)
+            shifted = jnp.take(model_planes_flat, rows * w + cols, axis=1, mode="clip")
+            distance_squared = (
+                (data_planes[0] - shifted[0])**2 +
+                (data_planes[1] - shifted[1])**2 +
+                (data_planes[2] - shifted[2])**2
+            )
+            counts += (distance_squared <= r**2) * in_bounds
+    return counts
+
+def threedp3_likelihood_sparse(
+    sparse_obs: SparseObservation,
+    rendered_xyz: jnp.ndarray,
+    r,
+    outlier_prob,
+    outlier_volume,
+    filter_size=3,
+):
+    """threedp3_likelihood evaluated only at the valid observed pixels, so the
+    cost scales with the size of the observed object instead of the image.
+    """
+    sparse_obs = _sparse_observation(sparse_obs)
+    counts = count_neighbors_sparse(sparse_obs, rendered_xyz, r, filter_size)
+    num_latent_points = (rendered_xyz[:,:,2] > 0.0).sum()
+    return log_likelihood_from_counts(counts, sparse_obs.valid, num_latent_points, r, outlier_prob, outlier_volume)
+
+threedp3_likelihood_sparse_parallel = jax.vmap(threedp3_likelihood_sparse, in_axes=(None, 0, None, None, None))
+
+
+def overlap_masks(
+    obs_xyz,
+    rendered_xyz: jnp.ndarray,
+    r,
+    filter_size=3,
+):
+    """Which observed pixels have a rendered point within r in their window, and
+    which rendered pixels have an observed point within r in theirs.
+    Both directions come from one pass over the window offsets, since the pair
+    (obs p, rendered p + s) is the pair (rendered q, obs q - s).
+    Returns:
+        obs_hit, rendered_hit: Arrays of shape (H, W)
+    """
+    obs_planes, _ = observation_planes_and_mask(obs_xyz)
+    h, w = obs_planes.shape[1:]
+    rendered_planes_padded = pad_planes(coordinate_planes(rendered_xyz), filter_size)
+    obs_hit = jnp.zeros((h, w), dtype=bool)
+    rendered_hit_padded = jnp.zeros(rendered_planes_padded.shape[1:], dtype=bool)
+    for i in range(2*filter_size + 1):
+        for j in range(2*filter_size + 1):
+            shifted = rendered_planes_padded[:, i:i+h, j:j+w]
+            distance_squared = (
+                (obs_planes[0] - shifted[0])**2 +
+                (obs_planes[1] - shifted[1])**2 +
+                (obs_planes[2] - shifted[2])**2
+            )
+            within = distance_squared <= r**2
+            obs_hit = obs_hit | within
+            rendered_hit_padded = rendered_hit_padded | jax.lax.pad(
+                within, False, ((i, 2*filter_size - i, 0), (j, 2*filter_size - j, 0))
+            )
+    return obs_hit, rendered_hit_padded[filter_size:filter_size+h, filter_size:filter_size+w]
 
 def threedp3_likelihood_get_counts(
     obs_xyz: jnp.ndarray,
     rendered_xyz: jnp.ndarray,
     r,
+    filter_size=3,
 ):
-    filter_size = 3
-    obs_mask = obs_xyz[:,:,2] > 0.0
+    """Overlap statistics between the observation and a rendered image.
+    Returns:
+        Array [observed points near a rendered point, observed points,
+               rendered points near an observed point, rendered points]
+    """
+    _, obs_mask = observation_planes_and_mask(obs_xyz)
     rendered_mask = rendered_xyz[:,:,2] > 0.0
-    
-    rendered_xyz_padded = jax.lax.pad(rendered_xyz,  -100.0, ((filter_size,filter_size,0,),(filter_size,filter_size,0,),(0,0,0,)))
-    jj, ii = jnp.meshgrid(jnp.arange(obs_xyz.shape[1]), jnp.arange(obs_xyz.shape[0]))
-    indices = jnp.stack([ii,jj],axis=-1)
-    counts_obs = count_ii_jj(indices, obs_xyz, rendered_xyz_padded, r, filter_size)
-    
-    obs_xyz_padded = jax.lax.pad(obs_xyz,  -100.0, ((filter_size,filter_size,0,),(filter_size,filter_size,0,),(0,0,0,)))
-    jj, ii = jnp.meshgrid(jnp.arange(rendered_xyz.shape[1]), jnp.arange(rendered_xyz.shape[0]))
-    indices = jnp.stack([ii,jj],axis=-1)
-    counts_rendered = count_ii_jj(indices, rendered_xyz, obs_xyz_padded, r, filter_size)
+    obs_hit, rendered_hit = overlap_masks(obs_xyz, rendered_xyz, r, filter_size)
     return jnp.array([
-        (obs_mask * (counts_obs > 0)).sum(), obs_mask.sum(), (rendered_mask * (counts_rendered > 0)).sum(), rendered_mask.sum()
-    ])
\ No newline at end of file
+        (obs_mask * obs_hit).sum(), obs_mask.sum(), (rendered_mask * rendered_hit).sum(), rendered_mask.sum()
+    ])
+
+def threedp3_likelihood_get_counts_parallel(
+    obs_xyz,
+    rendered_xyz: jnp.ndarray,
+    r,
+    filter_size=3,
+):
+    """threedp3_likelihood_get_counts over a batch of rendered images.
+    Args:
+        rendered_xyz (jnp.ndarray): Array of shape (N, H, W, 3+)
+    Returns:
+        counts: Array of shape (N, 4)
+    """
+    return jax.vmap(lambda rendered: threedp3_likelihood_get_counts(obs_xyz, rendered, r, filter_size))(rendered_xyz)
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import NamedTuple
+import numpy as np
+import trimesh
+
+# Preprocessed meshes stored as .npy files keyed by the hash of the mesh file, so
+# warm starts skip trimesh parsing and centering. Load a model with
+# load_model_cached and pass it to Renderer.load_model like a trimesh mesh.
+# Bump MODEL_CACHE_VERSION when preprocess_mesh or the stored fields change.
+
+MODEL_CACHE_VERSION = 1
+
+def default_cache_dir():
+    return os.environ.get(
+        "JAX3DP3_MODEL_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "jax3dp3", "models")
+    )
+
+class CachedModel(NamedTuple):
+    """Centered mesh. Arrays are read only memory maps when loaded from the cache."""
+    vertices: np.ndarray  # (V, 3) float32, bounding box centered at the origin
+    faces: np.ndarray  # (F, 3) int32
+    bbox_dims: np.ndarray  # (3,) float32
+    center: np.ndarray  # (3,) float32, bounding box center of the original mesh
+
+_FIELDS = CachedModel._fields
+
+def file_hash(filename, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def preprocess_mesh(mesh):
+    """CachedModel of a trimesh mesh. Same centering as jax3dp3.mesh.center_mesh."""
+    vertices = np.array(mesh.vertices, dtype=np.float64)
+    maxs, mins = vertices.max(axis=0), vertices.min(axis=0)
+    center = (maxs + mins) / 2
+    return CachedModel(
+        (vertices - center).astype(np.float32),
+        np.array(mesh.faces, dtype=np.int32),
+        (maxs - mins).astype(np.float32),
+        center.astype(np.float32),
+    )
+
+def load_model_cached(filename, cache_dir=None):
+    """Load and center the mesh in `filename`, going through the cache.
+    Args:
+        filename (str): mesh file readable by trimesh.load
+        cache_dir (str): defaults to $JAX3DP3_MODEL_CACHE or ~/.cache/jax3dp3/models
+    Returns:
+        model: CachedModel
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    entry_dir = os.path.join(cache_dir, f"v{MODEL_CACHE_VERSION}-{file_hash(filename)}")
+    if os.path.isdir(entry_dir):
+        return CachedModel(*[
+            np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode="r") for name in _FIELDS
+        ])
+
+    model = preprocess_mesh(trimesh.load(filename))
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary directory and rename it, so concurrent runs never see
+    # a partially written entry.
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+    for name in _FIELDS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(model, name))
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir)
+    return model
+
+def load_models_cached(filenames, cache_dir=None):
+    return [load_model_cached(filename, cache_dir) for filename in filenames]
@@ -0,0 +1,106 @@
+import jax.numpy as jnp
+import jax
+import numpy as np
+from typing import NamedTuple
+from jax3dp3.transforms_3d import rotation_from_axis_angle
+from jax3dp3.enumerations import make_rotation_grid_enumeration, make_translation_grid_enumeration_3d
+
+# Hierarchical pose grid. A cell is a cube in the tangent space of SO(3) around a
+# rotation times a cube of translations. Refining a cell splits both cubes in
+# half along every axis, so each cell has 8 rotation x 8 translation children
+# and the cell width halves at every level.
+
+class PoseCells(NamedTuple):
+    """A batch of N pose grid cells."""
+    rotation: jnp.ndarray  # (N, 3, 3) rotation at the cell center
+    rotation_half_width: jnp.ndarray  # (N,) half width of the tangent space cube, in radians
+    translation: jnp.ndarray  # (N, 3) translation at the cell center
+    translation_half_width: jnp.ndarray  # (N,)
+
+_CHILD_OFFSETS = jnp.array(np.stack(np.meshgrid([-0.5, 0.5], [-0.5, 0.5], [-0.5, 0.5], indexing="ij"), axis=-1).reshape(8, 3), dtype=jnp.float32)
+
+def make_root_cells(center, translation_half_width, num_translations_per_axis, fibonacci_sphere_points, num_planar_angle_points):
+    """Cells covering rotations from make_rotation_grid_enumeration times a
+    num_translations_per_axis^3 grid of translation cubes spanning
+    center +- translation_half_width.
+    """
+    rotations = make_rotation_grid_enumeration(fibonacci_sphere_points, num_planar_angle_points)[:, :3, :3]
+    # SO(3) has volume 8 pi^2, split evenly between the rotation cells.
+    rotation_half_width = 0.5 * (8 * jnp.pi**2 / rotations.shape[0]) ** (1.0 / 3.0)
+    cell_half_width = translation_half_width / num_translations_per_axis
+    extent = translation_half_width - cell_half_width
+    translations = jnp.asarray(center) + make_translation_grid_enumeration_3d(
+        -extent, -extent, -extent, extent, extent, extent,
+        num_translations_per_axis, num_translations_per_axis, num_translations_per_axis
+    )
+    num_rotations, num_translations = rotations.shape[0], translations.shape[0]
+    return PoseCells(
+        jnp.repeat(rotations, num_translations, axis=0),
+        jnp.full(num_rotations * num_translations, rotation_half_width),
+        jnp.tile(translations, (num_rotations, 1)),
+        jnp.full(num_rotations * num_translations, cell_half_width),
+    )
+
+def cell_poses(cells):
+    """Poses at the cell centers, Array of shape (N, 4, 4)."""
+    n = cells.rotation.shape[0]
+    poses = jnp.zeros((n, 4, 4)).at[:, 3, 3].set(1.0)
+    return poses.at[:, :3, :3].set(cells.rotation).at[:, :3, 3].set(cells.translation)
+
+def take_cells(cells, indices):
+    return jax.tree_util.tree_map(lambda x: x[indices], cells)
+
+def refine_cells(cells, refine_rotation=True, refine_translation=True):
+    """Children of every cell. Splitting both rotation and translation gives 64
+    children per cell, ordered cell major. Returns:
+        children: PoseCells with 64N, 8N or N cells
+    """
+    rotation, rotation_half_width = cells.rotation, cells.rotation_half_width
+    if refine_rotation:
+        tangents = rotation_half_width[:, None, None] * _CHILD_OFFSETS  # (N, 8, 3)
+        deltas = jax.vmap(
+            lambda v: rotation_from_axis_angle(v, jnp.linalg.norm(v))
+        )(tangents.reshape(-1, 3)).reshape(-1, 8, 3, 3)
+        rotation = jnp.einsum("nij,ncjk->ncik", rotation, deltas)
+        rotation_half_width = jnp.repeat(rotation_half_width[:, None] / 2, 8, axis=1)
+    else:
+        rotation = rotation[:, None]
+        rotation_half_width = rotation_half_width[:, None]
+
+    translation, translation_half_width = cells.translation, cells.translation_half_width
+    if refine_translation:
+        translation = translation[:, None] + translation_half_width[:, None, None] * _CHILD_OFFSETS
+        translation_half_width = jnp.repeat(translation_half_width[:, None] / 2, 8, axis=1)
+    else:
+        translation = translation[:, None]
+        translation_half_width = translation_half_width[:, None]
+
+    # Children of one cell are the product of its rotation and translation children.
+    num_r, num_t = rotation.shape[1], translation.shape[1]
+    n = cells.rotation.shape[0]
+    return PoseCells(
+        jnp.repeat(rotation, num_t, axis=1).reshape(n * num_r * num_t, 3, 3),
+        jnp.repeat(rotation_half_width, num_t, axis=1).reshape(-1),
+        jnp.tile(translation, (1, num_r, 1)).reshape(n * num_r * num_t, 3),
+        jnp.tile(translation_half_width, (1, num_r)).reshape(-1),
+    )
+
+def hierarchical_search(score_fn, root_cells, num_levels, top_k, refine_rotation=True, refine_translation=True):
+    """Score the root cells, then repeatedly refine only the top_k cells.
+    Every level after the first scores top_k * 64 poses, so the cost grows
+    linearly with the number of levels, i.e. logarithmically in the final cell width.
+    Args:
+        score_fn: maps poses of shape (N, 4, 4) to scores of shape (N,)
+        root_cells (PoseCells): e.g. from make_root_cells
+    Returns:
+        scores: Array of shape (top_k,), best first
+        cells: PoseCells of the top_k cells of the last level
+    """
+    cells = root_cells
+    for level in range(num_levels + 1):
+        if level > 0:
+            cells = refine_cells(cells, refine_rotation, refine_translation)
+        scores = score_fn(cell_poses(cells))
+        scores, indices = jax.lax.top_k(scores, min(top_k, scores.shape[0]))
+        cells = take_cells(cells, indices)
+    return scores, cells
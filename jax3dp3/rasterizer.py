@@ -0,0 +1,211 @@
+import jax.numpy as jnp
+import jax
+import numpy as np
+from typing import NamedTuple
+from jax3dp3.transforms_3d import apply_transform
+
+# Pure-XLA z-buffered triangle rasterizer. Produces the same (H,W,4) point cloud
+# images as the nvdiffrast GL plugin: camera frame (x,y,z,1) at covered pixels and
+# zeros elsewhere.
+
+DEFAULT_CHUNK_SIZE = 32
+# Triangles whose screen-space bounding box fits in WINDOW x WINDOW pixels are
+# only tested against the pixels of that window.
+DEFAULT_WINDOW = 32
+
+def mesh_to_triangles(mesh):
+    vertices = np.array(mesh.vertices, dtype=np.float32)
+    faces = np.array(mesh.faces, dtype=np.int32)
+    return jnp.array(vertices[faces])
+
+def _triangle_terms(tris):
+    # Moller-Trumbore with the ray origin at the camera center. Every term is
+    # linear in the ray direction: det, u and v are dot products of the ray with
+    # these vectors, t is the constant numerator over det.
+    p0 = tris[:, 0]
+    e1 = tris[:, 1] - p0
+    e2 = tris[:, 2] - p0
+    q = jnp.cross(-p0, e1)
+    return jnp.cross(e2, e1), jnp.cross(e2, -p0), q, jnp.sum(e2 * q, axis=-1)
+
+def _hit_depth(det, u_num, v_num, t_num, near, far):
+    nondegenerate = jnp.abs(det) > 1e-12
+    safe_det = jnp.where(nondegenerate, det, 1.0)
+    u = u_num / safe_det
+    v = v_num / safe_det
+    z = t_num / safe_det
+    hit = nondegenerate * (u >= 0.0) * (v >= 0.0) * (u + v <= 1.0) * (z >= near) * (z <= far)
+    return jnp.where(hit, z, jnp.inf)
+
+def _rasterize_full(depth, tris, rays, near, far):
+    # Every pixel against every triangle, a few (H,W,3)x(3,K) products.
+    n, u_dir, v_dir, t_num = _triangle_terms(tris)
+    z = _hit_depth(
+        jnp.einsum("hwk,nk->hwn", rays, n), jnp.einsum("hwk,nk->hwn", rays, u_dir),
+        jnp.einsum("hwk,nk->hwn", rays, v_dir), t_num, near, far,
+    )
+    return jnp.minimum(depth, z.min(axis=-1))
+
+def _rasterize_windows(depth, tris, origins, small, rays, near, far, window):
+    # Each triangle against the window x window pixels at its origin, scattered
+    # into the z-buffer with a min.
+    h, w = rays.shape[:2]
+    offsets = jnp.arange(window)
+    rows, cols = jnp.broadcast_arrays(
+        origins[:, 0, None, None] + offsets[None, :, None], origins[:, 1, None, None] + offsets[None, None, :]
+    )
+    inside = (rows >= 0) & (rows < h) & (cols >= 0) & (cols < w)
+    rows = jnp.clip(rows, 0, h - 1)
+    cols = jnp.clip(cols, 0, w - 1)
+    window_rays = rays[rows, cols]
+    n, u_dir, v_dir, t_num = _triangle_terms(tris)
+    z = _hit_depth(
+        jnp.einsum("kabj,kj->kab", window_rays, n), jnp.einsum("kabj,kj->kab", window_rays, u_dir),
+        jnp.einsum("kabj,kj->kab", window_rays, v_dir), t_num[:, None, None], near, far,
+    )
+    z = jnp.where(inside & small[:, None, None], z, jnp.inf)
+    return depth.at[rows, cols].min(z)
+
+def _screen_bounds(triangles, rays):
+    # Pixel bounding boxes of the triangles, from the pinhole ray grid of
+    # camera.camera_rays_from_params. Only meaningful when every vertex has z > 0.
+    h, w = rays.shape[:2]
+    col_scale = (rays[0, -1, 0] - rays[0, 0, 0]) / max(w - 1, 1)
+    row_scale = (rays[-1, 0, 1] - rays[0, 0, 1]) / max(h - 1, 1)
+    z = triangles[:, :, 2]
+    safe_z = jnp.where(z > 0.0, z, 1.0)
+    cols = (triangles[:, :, 0] / safe_z - rays[0, 0, 0]) / col_scale
+    rows = (triangles[:, :, 1] / safe_z - rays[0, 0, 1]) / row_scale
+    return (
+        jnp.floor(rows.min(axis=1)), jnp.ceil(rows.max(axis=1)),
+        jnp.floor(cols.min(axis=1)), jnp.ceil(cols.max(axis=1)),
+    )
+
+def rasterize_depth(triangles, rays, near, far, chunk_size=DEFAULT_CHUNK_SIZE, window=DEFAULT_WINDOW):
+    """Z-buffer of camera frame triangles.
+    Triangles outside the view or the near/far range are culled. Triangles whose
+    screen-space bounding box fits in window x window pixels are rasterized over
+    that window only, the rest (large or crossing z = 0) against every pixel.
+    window=None tests every triangle against every pixel without data dependent
+    loops, which XLA:CPU can deadlock on when run from inside a host callback.
+    Args:
+        triangles (jnp.ndarray): Array of shape (F, 3, 3), vertices in the camera frame.
+        rays (jnp.ndarray): Array of shape (H, W, 3), per pixel ray directions with z == 1,
+            as from camera.camera_rays_from_params.
+    Returns:
+        depth: Array of shape (H, W), depth of the closest triangle and inf where
+            no triangle between near and far covers the pixel.
+    """
+    h, w = rays.shape[:2]
+    num_faces = triangles.shape[0]
+    num_pad = (-num_faces) % chunk_size
+    # Zero triangles are degenerate and never cover a pixel.
+    padded = jnp.pad(triangles, ((0, num_pad), (0, 0), (0, 0)))
+    if window is None:
+        depth, _ = jax.lax.scan(
+            lambda depth, tris: (_rasterize_full(depth, tris, rays, near, far), None),
+            jnp.full((h, w), jnp.inf), padded.reshape(-1, chunk_size, 3, 3)
+        )
+        return depth
+
+    z = triangles[:, :, 2]
+    in_front = z.min(axis=1) > 0.0
+    row_min, row_max, col_min, col_max = _screen_bounds(triangles, rays)
+    on_screen = (row_max >= 0) & (row_min <= h - 1) & (col_max >= 0) & (col_min <= w - 1)
+    # Zero triangles (padding) have z.max() == 0 < near and are culled here.
+    visible = (z.max(axis=1) >= near) & (z.min(axis=1) <= far) & (on_screen | ~in_front)
+    small = visible & in_front & (row_max - row_min < window) & (col_max - col_min < window)
+    large = visible & ~small
+
+    origins = jnp.where(small[:, None], jnp.stack([row_min, col_min], axis=1), 0.0).astype(jnp.int32)
+    chunks = (
+        padded.reshape(-1, chunk_size, 3, 3),
+        jnp.pad(origins, ((0, num_pad), (0, 0))).reshape(-1, chunk_size, 2),
+        jnp.pad(small, (0, num_pad)).reshape(-1, chunk_size),
+    )
+    depth, _ = jax.lax.scan(
+        lambda depth, chunk: (_rasterize_windows(depth, *chunk, rays, near, far, window), None),
+        jnp.full((h, w), jnp.inf), chunks
+    )
+
+    # Large triangles are compacted to the front, chunks past the last one are skipped.
+    large_ids = jnp.nonzero(large, size=num_faces + num_pad, fill_value=num_faces + num_pad - 1)[0]
+    num_large_chunks = (large.sum() + chunk_size - 1) // chunk_size
+    large_only = padded * jnp.pad(large, (0, num_pad))[:, None, None]
+    def _large_chunk(state):
+        i, depth = state
+        ids = jax.lax.dynamic_slice(large_ids, (i * chunk_size,), (chunk_size,))
+        return i + 1, _rasterize_full(depth, large_only[ids], rays, near, far)
+    _, depth = jax.lax.while_loop(lambda state: state[0] < num_large_chunks, _large_chunk, (0, depth))
+    return depth
+
+def depth_to_point_cloud_image(depth, rays):
+    hit = jnp.isfinite(depth)
+    z = jnp.where(hit, depth, 0.0)
+    return jnp.concatenate([rays * z[:, :, None], hit[:, :, None].astype(rays.dtype)], axis=-1)
+
+def composite_point_cloud_images(image, background):
+    """Per pixel, the nearer of two point cloud images of shape (..., H, W, 4).
+    Pixels hit in only one of them come from that one. Broadcasts.
+    """
+    in_front = (image[..., 3] > 0) & ((background[..., 3] == 0) | (image[..., 2] < background[..., 2]))
+    return jnp.where(in_front[..., None], image, background)
+
+def render_multiobject(poses, triangles, rays, near, far, chunk_size=DEFAULT_CHUNK_SIZE, window=DEFAULT_WINDOW):
+    """Render several meshes into a single point cloud image.
+    Args:
+        poses (jnp.ndarray): Array of shape (M, 4, 4), one pose per object.
+        triangles (list): M arrays of shape (F_i, 3, 3), object frame triangles.
+        rays (jnp.ndarray): Array of shape (H, W, 3) from camera.camera_rays_from_params
+    Returns:
+        point_cloud_image: Array of shape (H, W, 4)
+    """
+    triangles_cam = jnp.concatenate(
+        [apply_transform(tri, pose) for (pose, tri) in zip(poses, triangles)]
+    )
+    depth = rasterize_depth(triangles_cam, rays, near, far, chunk_size, window)
+    return depth_to_point_cloud_image(depth, rays)
+
+def render_multiobject_parallel(poses, triangles, rays, near, far, chunk_size=DEFAULT_CHUNK_SIZE, window=DEFAULT_WINDOW):
+    return jax.vmap(
+        lambda p: render_multiobject(p, triangles, rays, near, far, chunk_size, window)
+    )(poses)
+
+
+class PackedTriangles(NamedTuple):
+    """Triangles of several models in one buffer, so the model can be chosen per
+    proposal inside jit/vmap. Model i is buffer[offsets[i]:offsets[i] + counts[i]].
+    """
+    buffer: jnp.ndarray  # (F_total + max_faces, 3, 3), zero padded at the end
+    offsets: jnp.ndarray  # (M,)
+    counts: jnp.ndarray  # (M,)
+    face_ids: jnp.ndarray  # (max_faces,) arange, its shape carries max_faces
+
+def pack_triangles(triangles):
+    counts = np.array([t.shape[0] for t in triangles], dtype=np.int32)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int32)
+    max_faces = int(counts.max())
+    # Padding at the end keeps every max_faces slice in bounds.
+    buffer = jnp.concatenate(list(triangles) + [jnp.zeros((max_faces, 3, 3), dtype=jnp.float32)])
+    return PackedTriangles(buffer, jnp.array(offsets), jnp.array(counts), jnp.arange(max_faces))
+
+def model_triangles(packed, model_idx):
+    """Triangles of model `model_idx`, padded to max_faces with degenerate zero triangles."""
+    triangles = jax.lax.dynamic_slice(
+        packed.buffer, (packed.offsets[model_idx], 0, 0), (packed.face_ids.shape[0], 3, 3)
+    )
+    return triangles * (packed.face_ids < packed.counts[model_idx])[:, None, None]
+
+def render_models_parallel(poses, model_indices, packed, rays, near, far, chunk_size=DEFAULT_CHUNK_SIZE, window=DEFAULT_WINDOW):
+    """Render a single object per image, each with its own model.
+    Every image costs as much as the largest model.
+    Args:
+        poses (jnp.ndarray): Array of shape (N, 4, 4)
+        model_indices (jnp.ndarray): Array of shape (N,)
+        packed (PackedTriangles): from pack_triangles
+    Returns:
+        point_cloud_images: Array of shape (N, H, W, 4)
+    """
+    return jax.vmap(
+        lambda pose, idx: render_multiobject(pose[None], [model_triangles(packed, idx)], rays, near, far, chunk_size, window)
+    )(poses, model_indices)
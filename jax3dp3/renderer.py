@@ -1,6 +1,9 @@
-import jax3dp3.nvdiffrast.common as dr
-import torch
 import jax3dp3.camera
+import jax3dp3.rasterizer
+from jax3dp3.likelihood import threedp3_likelihood
+import functools
+from functools import partial
+from jax3dp3.batched_scorer import batched_scorer, chunk_size_for_budget, pad_to_chunks
 import trimesh
 import jax.numpy as jnp
 import jax
@@ -8,48 +11,346 @@ import numpy as np
 import jax.dlpack
 import cv2
 
-RENDERER_ENV = None
-PROJ_LIST = None
-
-def setup_renderer(h, w, fx, fy, cx, cy, near, far, num_layers=2048):
-    global RENDERER_ENV
-    global PROJ_LIST
-    RENDERER_ENV = dr.RasterizeGLContext(h, w, output_db=False)
-    PROJ_LIST = list(jax3dp3.camera.open_gl_projection_matrix(h, w, fx, fy, cx, cy, near, far).reshape(-1))
-    dr._get_plugin(gl=True).setup(
-        RENDERER_ENV.cpp_wrapper,
-        h,w, num_layers
-    )
+class Renderer(object):
+    """Owns a camera, its model table and the rendering buffers.
+
+    Several renderers can be alive at once, e.g. a coarse renderer at a
+    fraction of the resolution next to a full resolution one.
+    backend="gl" renders through the nvdiffrast plugin and backend="jax"
+    through jax3dp3.rasterizer.
+    dtype=jnp.bfloat16 or jnp.float16 makes score_parallel compute the likelihood
+    distances in that dtype, after recentering on the observation (see
+    likelihood.low_precision_planes). Rendered images are always float32, since
+    absolute camera frame coordinates in reduced precision cannot resolve r.
+    """
+    def __init__(self, h, w, fx, fy, cx, cy, near, far, num_layers=2048, backend="gl", dtype=jnp.float32):
+        if backend not in ("gl", "jax"):
+            raise ValueError(f"Unknown renderer backend {backend}; expected 'gl' or 'jax'")
+        self.h, self.w = h, w
+        self.fx, self.fy, self.cx, self.cy = fx, fy, cx, cy
+        self.near, self.far = near, far
+        self.num_layers = num_layers
+        self.backend = backend
+        self.dtype = jnp.dtype(dtype)
+        self.meshes = []
+
+        if backend == "jax":
+            self.rays = jax3dp3.camera.camera_rays_from_params(h, w, fx, fy, cx, cy)
+            self.triangles = []
+            self._packed_triangles = None
+            return
+
+        import jax3dp3.nvdiffrast.common as dr
+        self.renderer_env = dr.RasterizeGLContext(h, w, output_db=False)
+        self.proj_list = list(jax3dp3.camera.open_gl_projection_matrix(h, w, fx, fy, cx, cy, near, far).reshape(-1))
+        dr._get_plugin(gl=True).setup(
+            self.renderer_env.cpp_wrapper,
+            h,w, num_layers
+        )
+
+    def scaled(self, scaling_factor):
+        """New renderer with the camera rescaled by `scaling_factor` and the same models loaded."""
+        h, w, fx, fy, cx, cy = jax3dp3.camera.scale_camera_parameters(
+            self.h, self.w, self.fx, self.fy, self.cx, self.cy, scaling_factor
+        )
+        renderer = Renderer(h, w, fx, fy, cx, cy, self.near, self.far, num_layers=self.num_layers, backend=self.backend, dtype=self.dtype)
+        for mesh in self.meshes:
+            renderer.load_model(mesh)
+        return renderer
+
+    def load_model(self, mesh):
+        """Add a model. `mesh` is a trimesh mesh or a jax3dp3.model_cache.CachedModel."""
+        self.meshes.append(mesh)
+        if self.backend == "jax":
+            self.triangles.append(jax3dp3.rasterizer.mesh_to_triangles(mesh))
+            self._packed_triangles = None
+            return
+
+        import torch
+        import jax3dp3.nvdiffrast.common as dr
+        vertices = np.array(mesh.vertices)
+        vertices = np.concatenate([vertices, np.ones((*vertices.shape[:-1],1))],axis=-1)
+        triangles = np.array(mesh.faces)
+        dr._get_plugin(gl=True).load_vertices_fwd(
+            self.renderer_env.cpp_wrapper, torch.tensor(vertices.astype("f"), device='cuda'),
+            torch.tensor(triangles.astype(np.int32), device='cuda'),
+        )
+
+    def render_to_torch(self, poses, idx):
+        import torch
+        import jax3dp3.nvdiffrast.common as dr
+        poses_torch = torch.utils.dlpack.from_dlpack(jax.dlpack.to_dlpack(poses))
+        images_torch = dr._get_plugin(gl=True).rasterize_fwd_gl(self.renderer_env.cpp_wrapper, poses_torch, self.proj_list, idx)
+        return images_torch
+
+    def render(self, poses, indices):
+        """Render a batch of multiobject scenes.
+        Args:
+            poses (jnp.ndarray): Array of shape (N, M, 4, 4)
+            indices (list): M model indices
+        Returns:
+            point_cloud_images: Array of shape (N, H, W, 4)
+        """
+        if self.backend == "jax":
+            return _render_jax(poses, [self.triangles[i] for i in indices], self.rays, self.near, self.far)
+
+        import torch
+        images_torch = self.render_to_torch(poses, indices)
+        return jax.dlpack.from_dlpack(torch.utils.dlpack.to_dlpack(images_torch))
+
+    def render_single_object(self, pose, idx):
+        return self.render(pose[None, None, :, :], [idx])[0]
+
+    def render_parallel(self, poses, idx):
+        return self.render(poses[:, None, :, :], [idx])
+
+    def render_multiobject(self, poses, indices):
+        return self.render(poses[None, :, :, :], indices)[0]
+
+    def render_multiobject_parallel(self, poses, indices):
+        return self.render(poses, indices)
+
+    def packed_triangles(self):
+        """All models in one jax3dp3.rasterizer.PackedTriangles, rebuilt after load_model."""
+        if self._packed_triangles is None:
+            self._packed_triangles = jax3dp3.rasterizer.pack_triangles(self.triangles)
+        return self._packed_triangles
+
+    def render_models_parallel(self, poses, model_indices):
+        """Render one object per image, each with its own model.
+        Args:
+            poses (jnp.ndarray): Array of shape (N, 4, 4)
+            model_indices (jnp.ndarray): Array of shape (N,)
+        Returns:
+            point_cloud_images: Array of shape (N, H, W, 4)
+        """
+        if self.backend == "jax":
+            return _render_models_jax(poses, model_indices, self.packed_triangles(), self.rays, self.near, self.far)
+        # GL renders one model per call, group the proposals by model.
+        model_indices = np.asarray(model_indices)
+        images = jnp.zeros((poses.shape[0], self.h, self.w, 4))
+        for idx in np.unique(model_indices):
+            selected = np.nonzero(model_indices == idx)[0]
+            images = images.at[selected].set(self.render_parallel(poses[selected], int(idx)))
+        return images
+
+    def render_function(self, use_callback=None):
+        """render(poses, model_indices) that can be used inside jax.jit and jax.vmap.
+        poses has shape (..., 4, 4) and model_indices broadcasts to poses.shape[:-2].
+        Returns point cloud images of shape (..., H, W, 4).
+
+        The jax backend traces the rasterizer directly. The GL backend goes through
+        jax.pure_callback, with a custom_vmap rule so a vmapped batch reaches the
+        plugin as one call instead of one call per element. use_callback=True forces
+        the callback on the jax backend, as a CPU reference for the GL path. That
+        callback runs jax itself, so wait for results (e.g. np.asarray) before
+        dispatching more work, or the CPU client deadlocks. It renders with the
+        full scan rasterizer (window=None) for the same reason.
+        """
+        if use_callback is None:
+            use_callback = self.backend != "jax"
+        h, w = self.h, self.w
+        if not use_callback:
+            packed, rays, near, far = self.packed_triangles(), self.rays, self.near, self.far
+            def render(poses, model_indices):
+                batch_shape = poses.shape[:-2]
+                model_indices = jnp.broadcast_to(model_indices, batch_shape)
+                images = jax3dp3.rasterizer.render_models_parallel(
+                    poses.reshape(-1, 4, 4), model_indices.reshape(-1), packed, rays, near, far
+                )
+                return images.reshape(*batch_shape, h, w, 4)
+            return render
+
+        def _host_render(poses, model_indices):
+            batch_shape = poses.shape[:-2]
+            poses = jnp.asarray(poses).reshape(-1, 4, 4)
+            model_indices = np.asarray(model_indices).reshape(-1)
+            if self.backend == "jax":
+                images = _render_models_jax(poses, model_indices, self.packed_triangles(), self.rays, self.near, self.far, window=None)
+            else:
+                images = self.render_models_parallel(poses, model_indices)
+            return np.asarray(images).reshape(*batch_shape, h, w, 4)
+
+        @jax.custom_batching.custom_vmap
+        def render(poses, model_indices):
+            model_indices = jnp.broadcast_to(jnp.asarray(model_indices, dtype=jnp.int32), poses.shape[:-2])
+            return jax.pure_callback(
+                _host_render, jax.ShapeDtypeStruct(poses.shape[:-2] + (h, w, 4), jnp.float32), poses, model_indices
+            )
+
+        @render.def_vmap
+        def _render_vmap(axis_size, in_batched, poses, model_indices):
+            poses_batched, indices_batched = in_batched
+            if not poses_batched:
+                poses = jnp.broadcast_to(poses, (axis_size,) + poses.shape)
+            if not indices_batched:
+                model_indices = jnp.broadcast_to(model_indices, (axis_size,) + jnp.shape(model_indices))
+            return render(poses, model_indices), True
+
+        return render
+
+    def score_parallel(self, poses, model_idx, obs_xyz, r, outlier_prob, outlier_volume, chunk_size=128, top_k=None, pose_fn=None, pose_args=(), memory_budget=None, background=None):
+        """Render and score pose proposals, `chunk_size` images at a time.
+        Peak memory depends on `chunk_size` and not on the number of proposals.
+        Args:
+            poses (jnp.ndarray): Array of shape (N, 4, 4), or compact proposals: any
+                pytree with leading dimension N that pose_fn(proposal, *pose_args)
+                maps to a (4, 4) pose, e.g. (N, 7) arrays with t3d.compact_to_pose or
+                contact sweeps with scene_graph.pose_from_contact_proposal. Compact
+                proposals are only expanded inside the scoring kernel.
+            model_idx: int, the model to render at every pose, or Array of shape (N,)
+                with one model per proposal. All models are then scored in one sweep,
+                and the top_k proposals are returned as (proposals, model_indices).
+            obs_xyz (jnp.ndarray): Array of shape (H, W, 3+), observed point cloud image
+            memory_budget (int): if given, bytes of device memory for one chunk,
+                and chunk_size is chosen to fit it.
+            background (Background): static content from prepare_background, e.g. the
+                table or the observed complement. Every proposal is rendered alone and
+                composited with it inside the likelihood.
+        Returns:
+            scores: Array of shape (N,), threedp3_likelihood of each proposal.
+            If `top_k` is given, also the top_k best scores and their proposals.
+        """
+        likelihood_dtype = None if self.dtype == jnp.float32 else self.dtype
+        if memory_budget is not None:
+            chunk_size = None
+        if jnp.ndim(model_idx) == 1:
+            scores = self._score_models_parallel(
+                poses, model_idx, obs_xyz, r, outlier_prob, outlier_volume, chunk_size, pose_fn, pose_args, memory_budget, background
+            )
+            poses = (poses, model_idx)
+        elif self.backend == "jax":
+            scores = batched_scorer(
+                _jax_scorer(likelihood_dtype, pose_fn), poses,
+                self.triangles[model_idx], self.rays, self.near, self.far,
+                obs_xyz, r, outlier_prob, outlier_volume, pose_args, background,
+                chunk_size=chunk_size, memory_budget=memory_budget,
+            )
+        else:
+            # The GL plugin renders outside of XLA, so chunks are a Python loop and
+            # only the likelihood counts towards the memory budget.
+            likelihood_parallel = _gl_likelihood(likelihood_dtype)
+            if chunk_size is None:
+                probe = jnp.zeros((1, self.h, self.w, 4))
+                chunk_size = chunk_size_for_budget(likelihood_parallel, probe, memory_budget, obs_xyz, r, outlier_prob, outlier_volume, background)
+            num_poses = jax.tree_util.tree_leaves(poses)[0].shape[0]
+            chunks, _ = pad_to_chunks(poses, min(chunk_size, num_poses))
+            scores = []
+            for i in range(jax.tree_util.tree_leaves(chunks)[0].shape[0]):
+                chunk = _expand_poses_jit(jax.tree_util.tree_map(lambda x: x[i], chunks), pose_args, pose_fn)
+                scores.append(likelihood_parallel(self.render_parallel(chunk, model_idx), obs_xyz, r, outlier_prob, outlier_volume, background))
+            scores = jnp.concatenate(scores)[:num_poses]
+
+        if top_k is None:
+            return scores
+        top_scores, top_indices = jax.lax.top_k(scores, top_k)
+        return scores, top_scores, jax.tree_util.tree_map(lambda x: x[top_indices], poses)
+
+    def _score_models_parallel(self, poses, model_indices, obs_xyz, r, outlier_prob, outlier_volume, chunk_size, pose_fn, pose_args, memory_budget, background):
+        if self.backend == "jax":
+            likelihood_dtype = None if self.dtype == jnp.float32 else self.dtype
+            return batched_scorer(
+                _jax_models_scorer(likelihood_dtype, pose_fn), (poses, jnp.asarray(model_indices)),
+                self.packed_triangles(), self.rays, self.near, self.far,
+                obs_xyz, r, outlier_prob, outlier_volume, pose_args, background,
+                chunk_size=chunk_size, memory_budget=memory_budget,
+            )
+        # GL renders one model per call, score the proposals of each model together.
+        model_indices = np.asarray(model_indices)
+        scores = jnp.zeros(model_indices.shape[0])
+        for idx in np.unique(model_indices):
+            selected = np.nonzero(model_indices == idx)[0]
+            scores = scores.at[selected].set(self.score_parallel(
+                jax.tree_util.tree_map(lambda x: x[selected], poses), int(idx), obs_xyz, r, outlier_prob, outlier_volume,
+                chunk_size=chunk_size, pose_fn=pose_fn, pose_args=pose_args, memory_budget=memory_budget,
+                background=background,
+            ))
+        return scores
+
+@jax.jit
+def _render_jax(poses, triangles, rays, near, far):
+    return jax3dp3.rasterizer.render_multiobject_parallel(poses, triangles, rays, near, far)
+
+def _expand_poses(proposals, pose_args, pose_fn):
+    if pose_fn is None:
+        return proposals
+    return jax.vmap(lambda p: pose_fn(p, *pose_args))(proposals)
+
+_expand_poses_jit = jax.jit(_expand_poses, static_argnames=("pose_fn",))
+
+def _score_proposals_jax(proposals, triangles, rays, near, far, obs_xyz, r, outlier_prob, outlier_volume, pose_args, background, dtype=None, pose_fn=None):
+    poses = _expand_poses(proposals, pose_args, pose_fn)
+    images = jax3dp3.rasterizer.render_multiobject_parallel(poses[:, None], [triangles], rays, near, far)
+    return jax.vmap(
+        lambda image: threedp3_likelihood(obs_xyz, image, r, outlier_prob, outlier_volume, dtype=dtype, background=background)
+    )(images)
+
+def _score_model_proposals_jax(proposals, packed, rays, near, far, obs_xyz, r, outlier_prob, outlier_volume, pose_args, background, dtype=None, pose_fn=None):
+    proposals, model_indices = proposals
+    poses = _expand_poses(proposals, pose_args, pose_fn)
+    images = jax3dp3.rasterizer.render_models_parallel(poses, model_indices, packed, rays, near, far)
+    return jax.vmap(
+        lambda image: threedp3_likelihood(obs_xyz, image, r, outlier_prob, outlier_volume, dtype=dtype, background=background)
+    )(images)
+
+@functools.partial(jax.jit, static_argnames=("window",))
+def _render_models_jax(poses, model_indices, packed, rays, near, far, window=jax3dp3.rasterizer.DEFAULT_WINDOW):
+    return jax3dp3.rasterizer.render_models_parallel(poses, model_indices, packed, rays, near, far, window=window)
+
+# Scorers are static arguments of batched_scorer, so the same settings must give
+# the same function object to reuse its compilation.
+@functools.lru_cache(maxsize=None)
+def _jax_scorer(dtype, pose_fn):
+    return partial(_score_proposals_jax, dtype=dtype, pose_fn=pose_fn)
+
+@functools.lru_cache(maxsize=None)
+def _jax_models_scorer(dtype, pose_fn):
+    return partial(_score_model_proposals_jax, dtype=dtype, pose_fn=pose_fn)
+
+@functools.lru_cache(maxsize=None)
+def _gl_likelihood(dtype):
+    return jax.jit(jax.vmap(
+        lambda image, obs_xyz, r, outlier_prob, outlier_volume, background: threedp3_likelihood(
+            obs_xyz, image, r, outlier_prob, outlier_volume, dtype=dtype, background=background
+        ),
+        in_axes=(0, None, None, None, None, None)
+    ))
+
+# Default renderer used by the module level functions below.
+RENDERER = None
+
+def setup_renderer(h, w, fx, fy, cx, cy, near, far, num_layers=2048, backend="gl", dtype=jnp.float32):
+    global RENDERER
+    RENDERER = Renderer(h, w, fx, fy, cx, cy, near, far, num_layers=num_layers, backend=backend, dtype=dtype)
+    return RENDERER
 
 def load_model(mesh):
-    vertices = np.array(mesh.vertices)
-    vertices = np.concatenate([vertices, np.ones((*vertices.shape[:-1],1))],axis=-1)
-    triangles = np.array(mesh.faces)
-    dr._get_plugin(gl=True).load_vertices_fwd(
-        RENDERER_ENV.cpp_wrapper, torch.tensor(vertices.astype("f"), device='cuda'),
-        torch.tensor(triangles.astype(np.int32), device='cuda'),
-    )
+    RENDERER.load_model(mesh)
 
-def render_to_torch(poses, idx):
-    poses_torch = torch.utils.dlpack.from_dlpack(jax.dlpack.to_dlpack(poses))
-    images_torch = dr._get_plugin(gl=True).rasterize_fwd_gl(RENDERER_ENV.cpp_wrapper, poses_torch, PROJ_LIST, idx)
-    return images_torch
+def render(poses, indices):
+    return RENDERER.render(poses, indices)
 
 def render_single_object(pose, idx):
-    images_torch = render_to_torch(pose[None, None, :, :], [idx])
-    return jax.dlpack.from_dlpack(torch.utils.dlpack.to_dlpack(images_torch[0]))
+    return RENDERER.render_single_object(pose, idx)
 
 def render_parallel(poses, idx):
-    images_torch = render_to_torch(poses[:, None, :, :], [idx])
-    return jax.dlpack.from_dlpack(torch.utils.dlpack.to_dlpack(images_torch))
+    return RENDERER.render_parallel(poses, idx)
 
 def render_multiobject(poses, indices):
-    images_torch = render_to_torch(poses[None, :, :, :], indices)
-    return jax.dlpack.from_dlpack(torch.utils.dlpack.to_dlpack(images_torch[0]))
+    return RENDERER.render_multiobject(poses, indices)
 
 def render_multiobject_parallel(poses, indices):
-    images_torch = render_to_torch(poses, indices)
-    return jax.dlpack.from_dlpack(torch.utils.dlpack.to_dlpack(images_torch))
+    return RENDERER.render_multiobject_parallel(poses, indices)
+
+def render_models_parallel(poses, model_indices):
+    return RENDERER.render_models_parallel(poses, model_indices)
+
+def score_parallel(poses, model_idx, obs_xyz, r, outlier_prob, outlier_volume, chunk_size=128, top_k=None, pose_fn=None, pose_args=(), memory_budget=None, background=None):
+    return RENDERER.score_parallel(
+        poses, model_idx, obs_xyz, r, outlier_prob, outlier_volume,
+        chunk_size=chunk_size, top_k=top_k, pose_fn=pose_fn, pose_args=pose_args, memory_budget=memory_budget,
+        background=background,
+    )
 
 
 
@@ -43,6 +43,19 @@ def pose_from_contact(
 ):
     return parent_pose.dot(relative_pose_from_contact(contact_params, face_parent, face_child, dims_parent, dims_child))
 
+def pose_from_contact_proposal(
+    proposal,
+    face_parent,
+    dims_parent, dims_child,
+    parent_pose
+):
+    """pose_from_contact of a compact (contact_params, face_child) proposal, as
+    produced by enumerate_contact_and_face_parameters. Pass it as `pose_fn` to
+    Renderer.score_parallel to score contact sweeps without building 4x4 poses.
+    """
+    contact_params, face_child = proposal
+    return pose_from_contact(contact_params, face_parent, face_child, dims_parent, dims_child, parent_pose)
+
 def get_contact_plane(
     parent_pose,
     dims_parent,
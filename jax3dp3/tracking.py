@@ -0,0 +1,171 @@
+import functools
+from typing import NamedTuple
+import jax
+import jax.numpy as jnp
+from jax.scipy.special import logsumexp
+from jax3dp3.batched_scorer import pad_to_chunks
+from jax3dp3.likelihood import prepare_background, threedp3_likelihood
+from jax3dp3.rasterizer import composite_point_cloud_images
+
+# Trackers that run a whole clip as one lax.scan over the frames. Rendering goes
+# through a traceable render function, e.g. Renderer.render_function().
+
+class ParticleFilterResult(NamedTuple):
+    trajectory: jnp.ndarray  # (T, 4, 4) highest weight particle of every frame
+    particles: jnp.ndarray  # (T, N, 4, 4) particles before resampling
+    log_weights: jnp.ndarray  # (T, N) normalized log weights
+    ess: jnp.ndarray  # (T,) effective sample size before resampling
+    log_marginal_likelihood: jnp.ndarray  # () estimate of log p(frames)
+
+def _gaussian_vmf_proposal(key, pose, var, concentration):
+    # tensorflow_probability is only imported when this default proposal is used.
+    import jax3dp3.distributions
+    return jax3dp3.distributions.gaussian_vmf_sample(key, pose, var, concentration)
+
+def systematic_resample(key, log_weights):
+    """Indices of N particles resampled in proportion to exp(log_weights)."""
+    n = log_weights.shape[0]
+    cdf = jnp.cumsum(jnp.exp(log_weights - logsumexp(log_weights)))
+    u = (jax.random.uniform(key) + jnp.arange(n)) / n
+    # side="right" so u == cdf[k] never selects a zero weight particle k.
+    return jnp.minimum(jnp.searchsorted(cdf, u, side="right"), n - 1)
+
+def score_poses(render, model_idx, obs_xyz, poses, r, outlier_prob, outlier_volume, chunk_size=None, background=None):
+    """threedp3_likelihood of every pose in (N, 4, 4), rendering chunk_size at a time.
+    If given, background (Background) is composited behind every rendered image.
+    """
+    def _score(p):
+        return jax.vmap(
+            lambda image: threedp3_likelihood(obs_xyz, image, r, outlier_prob, outlier_volume, background=background)
+        )(render(p, model_idx))
+    if chunk_size is None or chunk_size >= poses.shape[0]:
+        return _score(poses)
+    chunks, _ = pad_to_chunks(poses, chunk_size)
+    return jax.lax.map(_score, chunks).reshape(-1)[:poses.shape[0]]
+
+@functools.partial(jax.jit, static_argnames=("render", "num_particles", "proposal", "chunk_size"))
+def particle_filter(
+    key,
+    render,
+    model_idx,
+    frames,
+    init_pose,
+    num_particles,
+    var,
+    concentration,
+    r,
+    outlier_prob,
+    outlier_volume,
+    proposal=None,
+    chunk_size=None,
+):
+    """Bootstrap particle filter over a clip, compiled as a single lax.scan.
+    Every frame moves the particles with proposal(key, pose, var, concentration),
+    weights them with threedp3_likelihood and resamples systematically.
+    Args:
+        render: traceable render(poses, model_idx), e.g. Renderer.render_function().
+            Must be the same object across calls to reuse the compilation.
+        frames (jnp.ndarray): Array of shape (T, H, W, 3+), observed point cloud images
+        init_pose (jnp.ndarray): Array of shape (4, 4)
+        proposal: defaults to distributions.gaussian_vmf_sample
+    Returns:
+        ParticleFilterResult
+    """
+    if proposal is None:
+        proposal = _gaussian_vmf_proposal
+    particles = jnp.tile(init_pose, (num_particles, 1, 1))
+
+    def _step(particles, inputs):
+        key, obs_xyz = inputs
+        key_proposal, key_resample = jax.random.split(key)
+        particles = jax.vmap(proposal, in_axes=(0, 0, None, None))(
+            jax.random.split(key_proposal, num_particles), particles, var, concentration
+        )
+        scores = score_poses(render, model_idx, obs_xyz, particles, r, outlier_prob, outlier_volume, chunk_size)
+        log_normalizer = logsumexp(scores)
+        log_weights = scores - log_normalizer
+        ess = 1.0 / jnp.sum(jnp.exp(2 * log_weights))
+        best = particles[scores.argmax()]
+        resampled = particles[systematic_resample(key_resample, log_weights)]
+        return resampled, (best, particles, log_weights, ess, log_normalizer - jnp.log(num_particles))
+
+    keys = jax.random.split(key, frames.shape[0])
+    _, (trajectory, all_particles, log_weights, ess, log_marginals) = jax.lax.scan(_step, particles, (keys, frames))
+    return ParticleFilterResult(trajectory, all_particles, log_weights, ess, log_marginals.sum())
+
+class MultiObjectTrackResult(NamedTuple):
+    poses: jnp.ndarray  # (T, M, 4, 4) poses after the last sweep of every frame
+    scores: jnp.ndarray  # (T,) likelihood of the whole scene at those poses
+
+def _rest_of_scene(images, active):
+    # Composite of every object image except the active one.
+    empty = jnp.zeros_like(images[0])
+    rest = empty
+    for j in range(images.shape[0]):
+        rest = composite_point_cloud_images(rest, jnp.where(j == active, empty, images[j]))
+    return rest
+
+@functools.partial(jax.jit, static_argnames=("render", "num_sweeps", "chunk_size"))
+def block_gibbs_tracker(
+    render,
+    model_indices,
+    frames,
+    init_poses,
+    pose_deltas,
+    r,
+    outlier_prob,
+    outlier_volume,
+    key=None,
+    num_sweeps=1,
+    chunk_size=None,
+):
+    """Track M objects through a clip with block coordinate updates, compiled
+    as nested lax.scans over frames and objects.
+    Each update proposes pose @ delta for the active object only, renders just
+    those proposals and composites them with the cached images of the other
+    objects, so an update renders E + 1 images whatever M is.
+    Args:
+        render: traceable render(poses, model_indices), e.g. Renderer.render_function()
+        model_indices (jnp.ndarray): Array of shape (M,)
+        frames (jnp.ndarray): Array of shape (T, H, W, 3+), observed point cloud images
+        init_poses (jnp.ndarray): Array of shape (M, 4, 4)
+        pose_deltas (jnp.ndarray): Array of shape (E, 4, 4), e.g. make_translation_grid_enumeration
+        key: if given, the new pose is sampled from the proposals in proportion to
+            their likelihood (a Gibbs step on the grid), otherwise the best is kept.
+    Returns:
+        MultiObjectTrackResult
+    """
+    model_indices = jnp.asarray(model_indices)
+    num_objects = init_poses.shape[0]
+    if key is None:
+        keys = jnp.zeros((frames.shape[0], num_sweeps * num_objects, 2), dtype=jnp.uint32)
+    else:
+        keys = jax.random.split(key, frames.shape[0] * num_sweeps * num_objects)
+        keys = keys.reshape(frames.shape[0], num_sweeps * num_objects, *keys.shape[1:])
+    order = jnp.tile(jnp.arange(num_objects), num_sweeps)
+
+    def _frame(carry, inputs):
+        poses, images = carry
+        obs_xyz, frame_keys = inputs
+
+        def _update(carry, inputs):
+            poses, images = carry
+            i, update_key = inputs
+            proposals = jnp.einsum("ij,ajk->aik", poses[i], pose_deltas)
+            scores = score_poses(
+                render, model_indices[i], obs_xyz, proposals, r, outlier_prob, outlier_volume,
+                chunk_size, background=prepare_background(_rest_of_scene(images, i))
+            )
+            if key is None:
+                best = scores.argmax()
+            else:
+                best = jax.random.categorical(update_key, scores)
+            pose = proposals[best]
+            return (poses.at[i].set(pose), images.at[i].set(render(pose, model_indices[i]))), scores[best]
+
+        (poses, images), scores = jax.lax.scan(_update, (poses, images), (order, frame_keys))
+        return (poses, images), (poses, scores[-1])
+
+    init_images = render(init_poses, model_indices)
+    _, (poses, scores) = jax.lax.scan(_frame, (init_poses, init_images), (frames, keys))
+    return MultiObjectTrackResult(poses, scores)
@@ -179,6 +179,16 @@ def rotation_matrix_to_quaternion(matrix):
     return q * 0.5 / jnp.sqrt(t)
 
 
+# Compact poses: quaternion (w, x, y, z) followed by the translation, 7 floats
+# instead of the 16 of a 4x4 matrix.
+def pose_to_compact(pose):
+    return jnp.concatenate([rotation_matrix_to_quaternion(pose[:3,:3]), pose[:3,3]])
+
+def compact_to_pose(compact):
+    quaternion = compact[:4] / jnp.linalg.norm(compact[:4])
+    return transform_from_rot_and_pos(quaternion_to_rotation_matrix(quaternion), compact[4:])
+
+
 def depth_to_point_cloud_image(
     depth: np.ndarray,
     fx, fy, cx, cy,
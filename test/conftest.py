@@ -0,0 +1,10 @@
+import pytest
+import jax3dp3.enumerations as enumerations
+
+@pytest.fixture(autouse=True)
+def enumeration_cache(monkeypatch):
+    """Keep enumerations in memory only, tests that need the files set a directory."""
+    monkeypatch.setattr(enumerations, "ENUMERATION_CACHE_DIR", None)
+    enumerations.clear_enumeration_cache()
+    yield
+    enumerations.clear_enumeration_cache()
@@ -0,0 +1,28 @@
+import jax
+import jax.numpy as jnp
+import pytest
+from jax3dp3.batched_scorer import batched_scorer, batched_scorer_parallel, bytes_per_proposal, chunk_size_for_budget
+from jax3dp3.jax_rendering import batch_split
+
+def scorer_parallel(x, scale):
+    return jnp.sin(x[:, :, None] * x[:, None, :]).sum(axis=(1, 2)) * scale
+
+def test_any_proposal_count():
+    x = jax.random.normal(jax.random.PRNGKey(0), (101, 20))
+    expected = scorer_parallel(x, 2.0)
+    for chunk_size in [1, 7, 64, 101, 500]:
+        assert jnp.allclose(batched_scorer(scorer_parallel, x, 2.0, chunk_size=chunk_size), expected, rtol=1e-4, atol=1e-4)
+    # 101 proposals do not split into 10 batches, the last batch is padded.
+    assert jnp.allclose(batched_scorer_parallel(lambda x: scorer_parallel(x, 1.0), 10, x), scorer_parallel(x, 1.0), rtol=1e-4, atol=1e-4)
+    with pytest.raises(ValueError):
+        batch_split(x, 10)
+
+def test_memory_budget():
+    x = jax.random.normal(jax.random.PRNGKey(0), (101, 20))
+    per_proposal = bytes_per_proposal(scorer_parallel, x, 2.0)
+    # The (N, 20, 20) intermediate dominates.
+    assert per_proposal >= 20 * 20 * 4
+    assert chunk_size_for_budget(scorer_parallel, x, 10 * per_proposal, 2.0) == 10
+    assert chunk_size_for_budget(scorer_parallel, x, 1, 2.0) == 1
+    scores = jax.jit(lambda x: batched_scorer(scorer_parallel, x, 2.0, memory_budget=10 * per_proposal))(x)
+    assert jnp.allclose(scores, scorer_parallel(x, 2.0), rtol=1e-4, atol=1e-4)
@@ -0,0 +1,60 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+import trimesh
+import jax3dp3
+import jax3dp3.transforms_3d as t3d
+from jax3dp3.coarse_to_fine import ContactScene, Hypotheses, make_stage, coarse_to_fine_contact_search, _refine_gl, _stage_gl
+
+h, w, fx, fy, cx, cy = 60, 80, 100.0, 100.0, 40.0, 30.0
+near, far = 0.01, 50.0
+
+def _make_scene():
+    renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax")
+    box_dims = jnp.array([[1.0, 1.0, 1.0], [0.6, 1.6, 0.4], [0.3, 0.3, 1.2]])
+    for dims in box_dims:
+        renderer.load_model(trimesh.creation.box(np.array(dims)))
+
+    # Table top facing the camera from below, tilted towards it.
+    table_pose = t3d.transform_from_pos(jnp.array([0.0, 1.0, 6.0])).dot(
+        t3d.transform_from_axis_angle(jnp.array([1.0, 0.0, 0.0]), -jnp.pi / 3)
+    )
+    scene = ContactScene(table_pose, jnp.array([10.0, 10.0, 0.1]), 2, box_dims)
+    true_params = jnp.array([0.15, -0.1, 0.4])
+    true_pose = jax3dp3.scene_graph.pose_from_contact(true_params, 2, 3, scene.table_dims, box_dims[1], table_pose)
+    obs = renderer.render_single_object(true_pose, 1)
+    assert (obs[:,:,2] > 0).sum() > 50
+    return renderer, scene, obs, true_pose
+
+def test_coarse_to_fine_contact_search():
+    renderer, scene, obs, true_pose = _make_scene()
+    stages = [
+        make_stage(0.3, jnp.pi, 5, 6, jnp.arange(6), 0.1, 2),
+        make_stage(0.1, jnp.pi / 4, 5, 5, jnp.arange(6), 0.05, 2),
+    ]
+    hypotheses = coarse_to_fine_contact_search(
+        renderer, obs, stages, scene, jnp.zeros(3), outlier_prob=0.01, outlier_volume=1.0, chunk_size=64
+    )
+    assert hypotheses.scores.shape == (2,)
+    assert hypotheses.scores[0] >= hypotheses.scores[1]
+    assert int(hypotheses.model_indices[0]) == 1
+    assert jnp.linalg.norm(hypotheses.poses[0][:3, 3] - true_pose[:3, 3]) < 0.1
+
+def test_gl_stage_matches_jax_stage():
+    # The GL stage renders through the render callback, which also runs on the jax backend.
+    renderer, scene, obs, _ = _make_scene()
+    stages = [
+        make_stage(0.3, jnp.pi, 3, 4, jnp.arange(6), 0.1, 2),
+        make_stage(0.1, jnp.pi / 4, 3, 4, jnp.arange(6), 0.05, 2),
+    ]
+    expected = coarse_to_fine_contact_search(renderer, obs, stages, scene, jnp.zeros(3), chunk_size=64)
+    hypotheses = Hypotheses(
+        jnp.full(3, -jnp.inf), jnp.arange(3), jnp.zeros((3, 3)), jnp.zeros(3, dtype=jnp.int32), jnp.tile(jnp.eye(4), (3, 1, 1))
+    )
+    for stage in stages:
+        hypotheses = _stage_gl(renderer, hypotheses, stage, scene, obs, None, 0.01, 1.0)
+    assert jnp.array_equal(hypotheses.model_indices, expected.model_indices)
+    assert jnp.allclose(hypotheses.scores, expected.scores, rtol=1e-5)
+    assert jnp.allclose(hypotheses.poses, expected.poses, atol=1e-5)
+    # Both stages reuse one compilation.
+    assert _refine_gl._cache_size() == 1
@@ -0,0 +1,75 @@
+import os
+import jax
+import jax.numpy as jnp
+import jax3dp3
+import jax3dp3.enumerations as enumerations
+
+def test_enumeration_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(enumerations, "ENUMERATION_CACHE_DIR", str(tmp_path))
+    enumerations.clear_enumeration_cache()
+    rotations = enumerations.make_rotation_grid_enumeration(10, 4)
+    assert rotations.shape == (40, 4, 4)
+    assert enumerations.make_rotation_grid_enumeration(10, 4) is rotations
+    assert len(os.listdir(tmp_path)) == 1
+
+    # A fresh process only finds the file on disk.
+    enumerations.clear_enumeration_cache()
+    assert jnp.array_equal(enumerations.make_rotation_grid_enumeration(10, 4), rotations)
+    assert jnp.array_equal(enumerations.get_rotation_proposals(10, 4), rotations)
+
+    translations = enumerations.make_translation_grid_enumeration(-1.0, -1.0, -1.0, 1.0, 1.0, 1.0, num_x=3, num_y=3, num_z=3)
+    grid = enumerations.make_grid_enumeration(-1.0, -1.0, -1.0, 1.0, 1.0, 1.0, 3, 3, 3, 10, 4)
+    assert grid.shape == (40 * 27, 4, 4)
+    assert jnp.allclose(grid[28], rotations[1] @ translations[1])
+    assert len(os.listdir(tmp_path)) == 2
+    assert "make_rotation_grid_enumeration" in enumerations.ENUMERATIONS
+
+def test_enumeration_cache_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(enumerations, "ENUMERATION_CACHE_DIR", str(tmp_path))
+    umask = os.umask(0o027)
+    try:
+        enumerations.make_rotation_grid_enumeration(10, 4)
+    finally:
+        os.umask(umask)
+    (filename,) = os.listdir(tmp_path)
+    assert os.stat(tmp_path / filename).st_mode & 0o777 == 0o640
+
+    # Files written by another version of the cache are not read.
+    monkeypatch.setattr(enumerations, "ENUMERATION_CACHE_VERSION", enumerations.ENUMERATION_CACHE_VERSION + 1)
+    enumerations.clear_enumeration_cache()
+    enumerations.make_rotation_grid_enumeration(10, 4)
+    assert len(os.listdir(tmp_path)) == 2
+
+def test_streaming_grid_enumeration():
+    rotations = enumerations.make_rotation_grid_enumeration(10, 4)
+    translations = enumerations.make_translation_grid_enumeration(-1.0, -1.0, -1.0, 1.0, 1.0, 1.0, 3, 3, 3)
+    grid = jnp.einsum("aij,bjk->abik", rotations, translations).reshape(-1, 4, 4)
+
+    chunks = list(enumerations.iter_grid_enumeration(rotations, translations, 128))
+    assert len(chunks) == 9
+    assert all(poses.shape == (128, 4, 4) for (_, poses, _) in chunks)
+    poses = jnp.concatenate([poses[valid] for (_, poses, valid) in chunks])
+    assert jnp.allclose(poses, grid)
+
+    score_fn = lambda poses: -jnp.linalg.norm(poses[:, :3, 3] - jnp.array([0.3, -0.2, 0.9]), axis=-1)
+    top_scores, top_indices, top_poses = enumerations.top_k_over_grid_enumeration(score_fn, rotations, translations, 128, 5)
+    expected_scores, expected_indices = jax.lax.top_k(score_fn(grid), 5)
+    assert jnp.allclose(top_scores, expected_scores)
+    assert jnp.allclose(top_poses, grid[top_indices])
+
+def test_grid_enumeration_compact():
+    grid = enumerations.make_grid_enumeration(-1.0, -1.0, -1.0, 1.0, 1.0, 1.0, 2, 2, 2, 10, 4)
+    compact = enumerations.make_grid_enumeration_compact(-1.0, -1.0, -1.0, 1.0, 1.0, 1.0, 2, 2, 2, 10, 4)
+    assert compact.shape == (grid.shape[0], 7)
+    assert jnp.allclose(jax.vmap(jax3dp3.t3d.compact_to_pose)(compact), grid, atol=1e-5)
+
+def test_enumeration_cache_under_jit(tmp_path, monkeypatch):
+    for cache_dir in [str(tmp_path), None]:
+        monkeypatch.setattr(enumerations, "ENUMERATION_CACHE_DIR", cache_dir)
+        enumerations.clear_enumeration_cache()
+        # A cold cache is filled from inside the trace with a concrete value.
+        value = jax.jit(lambda x: x + enumerations.make_rotation_grid_enumeration(10, 4)[:, 0, 0].sum())(1.0)
+        rotations = enumerations.make_rotation_grid_enumeration(10, 4)
+        assert not isinstance(rotations, jax.core.Tracer)
+        assert jnp.allclose(value, 1.0 + rotations[:, 0, 0].sum())
+    assert len(os.listdir(tmp_path)) == 1
@@ -0,0 +1,66 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+import trimesh
+import jax3dp3
+import jax3dp3.transforms_3d as t3d
+from jax3dp3.icp import icp_parallel
+
+h, w, fx, fy, cx, cy = 60, 80, 100.0, 100.0, 40.0, 30.0
+near, far = 0.01, 50.0
+
+def test_icp_parallel():
+    renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax")
+    renderer.load_model(trimesh.creation.box(np.array([1.0, 0.6, 0.8])))
+    render = renderer.render_function()
+    render_func = lambda pose: render(pose, 0)
+
+    gt_pose = t3d.transform_from_pos(jnp.array([0.1, -0.1, 4.0])).dot(
+        t3d.transform_from_axis_angle(jnp.array([0.0, 1.0, 0.0]), 0.3)
+    )
+    obs = render_func(gt_pose)
+    offsets = jnp.array([[0.0, 0.0, 0.0], [0.05, 0.0, 0.0], [0.0, -0.08, 0.05], [-0.1, 0.05, 0.0]])
+    init_poses = jax.vmap(lambda t: t3d.transform_from_pos(t).dot(gt_pose))(offsets)
+
+    result = jax.jit(lambda poses: icp_parallel(render_func, poses, obs, 60))(init_poses)
+    assert result.poses.shape == (4, 4, 4)
+    assert result.converged.all()
+    assert (result.iterations < 60).all()
+    # The hypothesis that starts at the answer stops right away.
+    assert int(result.iterations[0]) == 1
+    assert int(result.iterations.max()) > 1
+    errors = jnp.linalg.norm(result.poses[:, :3, 3] - gt_pose[:3, 3], axis=-1)
+    assert (errors < jnp.linalg.norm(offsets, axis=-1) + 1e-3).all()
+    assert errors[1:].max() < 0.03
+
+def test_nearest_neighbor_matches_patches():
+    from jax3dp3.icp import find_closest_point_at_pixel, get_nearest_neighbor
+    from jax3dp3.utils import extract_2d_patches
+    key_obs, key_rendered, key_mask = jax.random.split(jax.random.PRNGKey(0), 3)
+    obs = jax.random.uniform(key_obs, (24, 32, 3))
+    rendered = jax.random.uniform(key_rendered, (24, 32, 3)) * (jax.random.uniform(key_mask, (24, 32, 1)) > 0.5)
+    for window in [(10, 10), (5, 7)]:
+        expected = find_closest_point_at_pixel(obs, extract_2d_patches(rendered, window))
+        assert jnp.array_equal(get_nearest_neighbor(obs, rendered, window), expected)
+
+def test_icp_point_to_plane():
+    renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax")
+    renderer.load_model(trimesh.creation.box(np.array([1.0, 0.6, 0.8])))
+    render = renderer.render_function()
+    render_func = lambda pose: render(pose, 0)
+
+    # Three faces in view, so the planes constrain every direction.
+    gt_pose = t3d.transform_from_pos(jnp.array([0.1, -0.1, 4.0])).dot(
+        t3d.transform_from_axis_angle(jnp.array([1.0, 0.0, 0.0]), -0.4)
+    ).dot(t3d.transform_from_axis_angle(jnp.array([0.0, 1.0, 0.0]), 0.5))
+    obs = render_func(gt_pose)
+    offsets = jnp.array([[0.05, 0.0, 0.0], [0.0, -0.08, 0.05], [-0.1, 0.05, 0.0]])
+    init_poses = jax.vmap(lambda t: t3d.transform_from_pos(t).dot(gt_pose))(offsets)
+
+    refine = jax.jit(lambda poses, point_to_plane: icp_parallel(render_func, poses, obs, 60, point_to_plane=point_to_plane), static_argnums=1)
+    point_to_point = refine(init_poses, False)
+    point_to_plane = refine(init_poses, True)
+    assert point_to_plane.converged.all()
+    assert point_to_plane.iterations.max() < point_to_point.iterations.max()
+    errors = jnp.linalg.norm(point_to_plane.poses[:, :3, 3] - gt_pose[:3, 3], axis=-1)
+    assert errors.max() < 1e-3
@@ -0,0 +1,16 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = ("torch", "cv2", "trimesh", "matplotlib", "tensorflow_probability", "sklearn", "meshcat", "pyransac3d")
+
+def loaded_modules(statement):
+    code = f"import sys; {statement}; print(' '.join(sys.modules))"
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split()
+
+def test_import_is_light():
+    modules = loaded_modules("import jax3dp3; jax3dp3.threedp3_likelihood; jax3dp3.t3d.transform_from_pos")
+    assert not [m for m in HEAVY_MODULES if m in modules]
+
+def test_subsystems_load_on_access():
+    assert "trimesh" in loaded_modules("import jax3dp3; jax3dp3.setup_renderer")
+    assert "matplotlib" in loaded_modules("import jax3dp3; jax3dp3.viz")
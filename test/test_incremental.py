@@ -0,0 +1,52 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+import trimesh
+import jax3dp3
+import jax3dp3.transforms_3d as t3d
+from jax3dp3.incremental import (
+    make_incremental_scene, update_incremental_scene, incremental_likelihood, incremental_likelihood_parallel
+)
+from jax3dp3.rasterizer import composite_point_cloud_images
+
+h, w, fx, fy, cx, cy = 60, 80, 100.0, 100.0, 40.0, 30.0
+near, far = 0.01, 50.0
+r, outlier_prob, outlier_volume = 0.1, 0.01, 1.0
+
+def test_incremental_likelihood():
+    renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax")
+    renderer.load_model(trimesh.creation.box(np.array([0.8, 0.8, 0.8])))
+    renderer.load_model(trimesh.creation.box(np.array([0.5, 1.0, 0.5])))
+    render = renderer.render_function()
+
+    rest = renderer.render_single_object(t3d.transform_from_pos(jnp.array([0.5, 0.0, 5.0])), 0)
+    obs = composite_point_cloud_images(
+        renderer.render_single_object(t3d.transform_from_pos(jnp.array([-0.3, 0.1, 4.0])), 1), rest
+    )
+    state = make_incremental_scene(obs, rest, renderer.render_single_object(t3d.transform_from_pos(jnp.array([-0.4, 0.0, 4.0])), 1), r)
+    assert jnp.allclose(
+        incremental_likelihood(obs, state, render(state_pose := t3d.transform_from_pos(jnp.array([-0.4, 0.0, 4.0])), 1), r, outlier_prob, outlier_volume, (40, 40)),
+        jax3dp3.threedp3_likelihood(obs, composite_point_cloud_images(render(state_pose, 1), rest), r, outlier_prob, outlier_volume),
+        rtol=1e-5,
+    )
+
+    # Small moves stay in the window, the last ones cross the rest of the scene
+    # or leave the window and fall back to full images.
+    positions = jnp.array([[-0.35, 0.05, 4.0], [-0.3, 0.1, 4.0], [-0.2, 0.1, 4.2], [0.4, 0.0, 3.0], [-1.5, 0.5, 4.0]])
+    images = render(jax.vmap(t3d.transform_from_pos)(positions), 1)
+    expected = jax.vmap(
+        lambda image: jax3dp3.threedp3_likelihood(obs, composite_point_cloud_images(image, rest), r, outlier_prob, outlier_volume)
+    )(images)
+    for window in [(40, 40), (20, 20)]:
+        single = jnp.array([incremental_likelihood(obs, state, image, r, outlier_prob, outlier_volume, window) for image in images])
+        assert jnp.allclose(single, expected, rtol=1e-5)
+    assert jnp.allclose(incremental_likelihood_parallel(obs, state, images[:3], r, outlier_prob, outlier_volume, (40, 40)), expected[:3], rtol=1e-5)
+    assert jnp.allclose(incremental_likelihood_parallel(obs, state, images, r, outlier_prob, outlier_volume, (40, 40)), expected, rtol=1e-5)
+
+    # Accepting moves one after the other keeps the cache exact.
+    for image in images:
+        state = update_incremental_scene(obs, state, image, r, (40, 40))
+    full = make_incremental_scene(obs, rest, images[-1], r)
+    assert jnp.array_equal(state.counts, full.counts)
+    assert jnp.array_equal(state.count_histogram, full.count_histogram)
+    assert state.num_latent_points == full.num_latent_points
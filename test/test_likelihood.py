@@ -0,0 +1,160 @@
+import numpy as np
+import pytest
+import jax.numpy as jnp
+import jax
+import jax3dp3
+from jax3dp3.likelihood import count_ii_jj, count_neighbors
+
+h, w = 24, 32
+key = jax.random.PRNGKey(0)
+
+def make_images(key):
+    key_obs, key_rendered, key_mask = jax.random.split(key, 3)
+    obs = jax.random.uniform(key_obs, (h, w, 3), minval=0.5, maxval=1.0)
+    rendered = obs + 0.05 * jax.random.normal(key_rendered, (h, w, 3))
+    rendered = rendered * (jax.random.uniform(key_mask, (h, w, 1)) > 0.3)
+    rendered = jnp.concatenate([rendered, (rendered[:,:,2:3] > 0).astype(jnp.float32)], axis=-1)
+    return obs, rendered
+
+def count_ii_jj_reference(data_xyz, model_xyz, r, filter_size):
+    model_xyz_padded = jax.lax.pad(model_xyz[:,:,:3], -100.0, ((filter_size,filter_size,0,),(filter_size,filter_size,0,),(0,0,0,)))
+    jj, ii = jnp.meshgrid(jnp.arange(data_xyz.shape[1]), jnp.arange(data_xyz.shape[0]))
+    indices = jnp.stack([ii,jj],axis=-1)
+    return count_ii_jj(indices, data_xyz, model_xyz_padded, r, filter_size)
+
+def test_count_neighbors_matches_gather():
+    obs, rendered = make_images(key)
+    for filter_size in [0, 1, 3]:
+        for r in [0.02, 0.1, 0.3]:
+            expected = count_ii_jj_reference(obs, rendered, r, filter_size)
+            counts = count_neighbors(obs, rendered, r, filter_size)
+            # Squared distances avoid the sqrt, which may flip points exactly at r.
+            assert jnp.abs(counts - expected).sum() <= 2
+
+def test_likelihood_filter_size():
+    obs, rendered = make_images(key)
+    small = jax3dp3.threedp3_likelihood(obs, rendered, 0.1, 0.01, 1.0, filter_size=1)
+    large = jax3dp3.threedp3_likelihood(obs, rendered, 0.1, 0.01, 1.0, filter_size=3)
+    assert jnp.isfinite(small) and jnp.isfinite(large)
+    assert large > small
+
+    counts = jax3dp3.threedp3_likelihood_get_counts(obs, rendered, 0.1)
+    assert counts[1] == h * w
+    assert counts[3] == (rendered[:,:,2] > 0).sum()
+
+def test_likelihood_sweep():
+    obs, rendered = make_images(key)
+    rendered_images = jnp.stack([rendered[:,:,:3], obs, jnp.zeros_like(obs)])
+    r_array = jnp.array([0.02, 0.05, 0.1])
+    outlier_prob_array = jnp.array([0.01, 0.1])
+    scores = jax.jit(jax3dp3.threedp3_likelihood_sweep)(obs, rendered_images, r_array, outlier_prob_array, 2.0)
+    assert scores.shape == (3, 2, 3)
+    for i, r in enumerate(r_array):
+        for j, outlier_prob in enumerate(outlier_prob_array):
+            expected = jax3dp3.threedp3_likelihood_parallel(obs, rendered_images, r, outlier_prob, 2.0)
+            assert jnp.allclose(scores[i, j], expected, rtol=1e-5)
+
+def test_sparse_likelihood():
+    obs, rendered = make_images(key)
+    obs = obs * (jnp.arange(w) < 10)[None, :, None]
+    num_valid = int((obs[:,:,2] > 0).sum())
+
+    sparse_obs = jax3dp3.make_sparse_observation(obs)
+    assert sparse_obs.rows.shape == (num_valid,)
+    sparse_obs_padded = jax.jit(jax3dp3.make_sparse_observation, static_argnums=1)(obs, num_valid + 50)
+    assert sparse_obs_padded.valid.sum() == num_valid
+
+    expected = jax3dp3.threedp3_likelihood(obs, rendered, 0.1, 0.01, 2.0)
+    for s in [sparse_obs, sparse_obs_padded]:
+        assert jnp.allclose(jax3dp3.threedp3_likelihood_sparse(s, rendered, 0.1, 0.01, 2.0), expected, rtol=1e-5)
+
+    rendered_images = jnp.stack([rendered, jnp.zeros_like(rendered)])
+    assert jnp.allclose(
+        jax3dp3.threedp3_likelihood_sparse_parallel(sparse_obs_padded, rendered_images, 0.1, 0.01, 2.0),
+        jax3dp3.threedp3_likelihood_parallel(obs, rendered_images, 0.1, 0.01, 2.0),
+        rtol=1e-5
+    )
+
+def test_prepared_observation():
+    obs, rendered = make_images(key)
+    obs = obs * ((jnp.arange(h) >= 5) * (jnp.arange(h) < 15))[:, None, None] * (jnp.arange(w) < 20)[None, :, None]
+    prepared = jax3dp3.prepare_observation(obs)
+    assert jnp.all(prepared.bbox == jnp.array([5, 14, 0, 19]))
+    assert prepared.num_points == 200
+
+    assert jnp.allclose(
+        jax3dp3.threedp3_likelihood(prepared, rendered, 0.1, 0.01, 2.0),
+        jax3dp3.threedp3_likelihood(obs, rendered, 0.1, 0.01, 2.0),
+    )
+    assert jnp.allclose(
+        jax3dp3.threedp3_likelihood(prepared, rendered, 0.1, 0.01, 2.0, filter_size=1),
+        jax3dp3.threedp3_likelihood(obs, rendered, 0.1, 0.01, 2.0, filter_size=1),
+    )
+    assert jnp.all(
+        jax3dp3.threedp3_likelihood_get_counts(prepared, rendered, 0.1, filter_size=2) ==
+        jax3dp3.threedp3_likelihood_get_counts(obs, rendered, 0.1, filter_size=2)
+    )
+    assert prepared.sparse is None
+    with pytest.raises(ValueError):
+        jax3dp3.threedp3_likelihood_sparse(prepared, rendered, 0.1, 0.01, 2.0)
+    prepared = jax3dp3.prepare_observation(obs, capacity=h * w)
+    assert jnp.allclose(
+        jax3dp3.threedp3_likelihood_sparse(prepared, rendered, 0.1, 0.01, 2.0),
+        jax3dp3.threedp3_likelihood(obs, rendered, 0.1, 0.01, 2.0),
+        rtol=1e-5
+    )
+    scores = jax.jit(jax3dp3.threedp3_likelihood_parallel)(prepared, rendered[None], 0.1, 0.01, 2.0)
+    assert jnp.allclose(scores[0], jax3dp3.threedp3_likelihood(obs, rendered, 0.1, 0.01, 2.0))
+
+    # Segments with different numbers of pixels give the same shapes.
+    shapes = lambda x: jax.tree_util.tree_map(jnp.shape, x)
+    assert shapes(jax3dp3.prepare_observation(obs)) == shapes(jax3dp3.prepare_observation(obs * 0.0))
+
+def test_get_counts_parallel():
+    obs, rendered = make_images(key)
+    _, rendered_2 = make_images(jax.random.PRNGKey(1))
+    obs = obs * (jnp.arange(w) < 20)[None, :, None]
+    rendered_images = jnp.stack([rendered, rendered_2, jnp.zeros_like(rendered)])
+    for filter_size in [1, 3]:
+        counts = jax.jit(jax3dp3.threedp3_likelihood_get_counts_parallel, static_argnums=3)(obs, rendered_images, 0.1, filter_size)
+        assert counts.shape == (3, 4)
+        for i in range(3):
+            rendered_mask = rendered_images[i][:,:,2] > 0
+            obs_mask = obs[:,:,2] > 0
+            expected = jnp.array([
+                (obs_mask * (count_neighbors(obs, rendered_images[i], 0.1, filter_size) > 0)).sum(), obs_mask.sum(),
+                (rendered_mask * (count_neighbors(rendered_images[i], obs, 0.1, filter_size) > 0)).sum(), rendered_mask.sum(),
+            ])
+            assert jnp.all(counts[i] == expected)
+
+def test_low_precision():
+    obs, rendered = make_images(jax.random.PRNGKey(7))
+    # Shift the scene away from the origin, where absolute coordinates alone
+    # would not resolve r in bfloat16.
+    obs = obs.at[:,:,2].add(3.0 * (obs[:,:,2] > 0))
+    rendered = rendered.at[:,:,2].add(3.0 * (rendered[:,:,2] > 0))
+    expected = jax3dp3.threedp3_likelihood(obs, rendered, 0.1, 0.01, 1.0)
+    # bfloat16 keeps 8 mantissa bits, float16 keeps 11.
+    for (dtype, rtol) in [(jnp.bfloat16, 2e-2), (jnp.float16, 1e-3)]:
+        score = jax3dp3.threedp3_likelihood(obs, rendered, 0.1, 0.01, 1.0, dtype=dtype)
+        assert score.dtype == jnp.float32
+        assert jnp.allclose(score, expected, rtol=rtol)
+
+def test_background_compositing():
+    key = jax.random.PRNGKey(3)
+    obs = jax.random.uniform(key, (30, 40, 3)) + jnp.array([0.0, 0.0, 1.0])
+    rendered = jax.random.uniform(jax.random.PRNGKey(4), (5, 30, 40, 4)) * jnp.array([1.0, 1.0, 3.0, 1.0])
+    rendered = rendered * (jax.random.uniform(jax.random.PRNGKey(5), (5, 30, 40, 1)) > 0.3)
+    background = jax.random.uniform(jax.random.PRNGKey(6), (30, 40, 3)) * jnp.array([1.0, 1.0, 3.0])
+    background = background * (jax.random.uniform(jax.random.PRNGKey(7), (30, 40, 1)) > 0.5)
+
+    for occlude_only, combine in [
+        (False, jax.vmap(jax3dp3.renderer.combine_rendered_with_groud_truth, in_axes=(0, None))),
+        (True, jax3dp3.renderer.get_complement_masked_images),
+    ]:
+        expected = jax3dp3.threedp3_likelihood_parallel(obs, combine(rendered, background), 0.1, 0.01, 2.0)
+        prepared = jax3dp3.prepare_background(background, occlude_only=occlude_only)
+        actual = jax.vmap(
+            lambda image: jax3dp3.threedp3_likelihood(obs, image, 0.1, 0.01, 2.0, background=prepared)
+        )(rendered)
+        assert jnp.allclose(actual, expected, rtol=1e-5)
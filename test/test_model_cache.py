@@ -0,0 +1,37 @@
+import os
+import numpy as np
+import jax.numpy as jnp
+import trimesh
+import jax3dp3
+import jax3dp3.transforms_3d as t3d
+from jax3dp3.model_cache import load_model_cached
+
+cube_path = os.path.join(jax3dp3.utils.get_assets_dir(), "cube.obj")
+
+def test_cold_and_warm_load(tmp_path):
+    cold = load_model_cached(cube_path, cache_dir=str(tmp_path))
+    warm = load_model_cached(cube_path, cache_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    assert isinstance(warm.vertices, np.memmap)
+    assert warm.vertices.dtype == np.float32 and warm.faces.dtype == np.int32
+    for (a, b) in zip(cold, warm):
+        assert np.array_equal(a, b)
+
+    mesh = jax3dp3.mesh.center_mesh(trimesh.load(cube_path))
+    assert np.allclose(warm.vertices, mesh.vertices)
+    assert np.array_equal(warm.faces, mesh.faces)
+    assert np.allclose(warm.bbox_dims, jax3dp3.utils.axis_aligned_bounding_box(mesh.vertices)[0])
+
+def test_cache_version(tmp_path, monkeypatch):
+    load_model_cached(cube_path, cache_dir=str(tmp_path))
+    # Entries written by another version of preprocess_mesh are not read.
+    monkeypatch.setattr(jax3dp3.model_cache, "MODEL_CACHE_VERSION", jax3dp3.model_cache.MODEL_CACHE_VERSION + 1)
+    assert not isinstance(load_model_cached(cube_path, cache_dir=str(tmp_path)).vertices, np.memmap)
+    assert len(os.listdir(tmp_path)) == 2
+
+def test_render_cached_model(tmp_path):
+    renderer = jax3dp3.Renderer(30, 40, 50.0, 50.0, 20.0, 15.0, 0.01, 50.0, backend="jax")
+    renderer.load_model(trimesh.load(cube_path))
+    renderer.load_model(load_model_cached(cube_path, cache_dir=str(tmp_path)))
+    pose = t3d.transform_from_pos(jnp.array([0.0, 0.0, 4.0]))
+    assert jnp.allclose(renderer.render_single_object(pose, 0), renderer.render_single_object(pose, 1), atol=1e-5)
@@ -0,0 +1,34 @@
+import jax
+import jax.numpy as jnp
+import jax3dp3
+import jax3dp3.transforms_3d as t3d
+from jax3dp3.pose_grid import make_root_cells, refine_cells, cell_poses, hierarchical_search
+
+def test_refine_cells():
+    cells = make_root_cells(jnp.array([0.0, 0.0, 1.0]), 0.2, 2, 10, 4)
+    assert cells.rotation.shape == (40 * 8, 3, 3)
+    children = refine_cells(cells)
+    assert children.rotation.shape == (40 * 8 * 64, 3, 3)
+    assert jnp.allclose(children.translation_half_width, 0.05)
+    # Child centers lie inside their parent cell.
+    offsets = children.translation.reshape(-1, 64, 3) - cells.translation[:, None]
+    assert jnp.all(jnp.abs(offsets) <= cells.translation_half_width[:, None, None])
+    # Children are rotations.
+    assert jnp.allclose(jnp.einsum("nji,njk->nik", children.rotation, children.rotation), jnp.eye(3), atol=1e-5)
+    assert refine_cells(cells, refine_rotation=False).rotation.shape == (40 * 8 * 8, 3, 3)
+
+def test_hierarchical_search():
+    target = t3d.transform_from_rot_and_pos(
+        t3d.rotation_from_axis_angle(jnp.array([1.0, 2.0, 0.5]), 1.0), jnp.array([0.03, -0.07, 1.02])
+    )
+    def score_fn(poses):
+        rotation_error = jnp.linalg.norm(poses[:, :3, :3] - target[:3, :3], axis=(1, 2))
+        translation_error = jnp.linalg.norm(poses[:, :3, 3] - target[:3, 3], axis=-1)
+        return -(rotation_error + 10.0 * translation_error)
+
+    root = make_root_cells(jnp.array([0.0, 0.0, 1.0]), 0.2, 2, 50, 10)
+    scores, cells = hierarchical_search(jax.jit(score_fn), root, 5, 4)
+    best = cell_poses(cells)[0]
+    assert scores.shape == (4,)
+    assert jnp.linalg.norm(best[:3, 3] - target[:3, 3]) < 0.01
+    assert jnp.linalg.norm(best[:3, :3] - target[:3, :3]) < 0.05
@@ -0,0 +1,205 @@
+import numpy as np
+import jax.numpy as jnp
+import jax
+import jax3dp3
+import jax3dp3.transforms_3d as t3d
+import trimesh
+import os
+
+h, w, fx,fy, cx,cy = (
+    60,
+    80,
+    100.0,100.0,
+    40.0,30.0
+)
+near,far = 0.01, 50.0
+
+# An instance rather than the global renderer, which other test modules replace.
+cube_renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax")
+mesh = trimesh.load(os.path.join(jax3dp3.utils.get_assets_dir(),"cube.obj"))
+cube_renderer.load_model(mesh)
+
+pose = t3d.transform_from_pos(jnp.array([0.0, 0.0, 4.0]))
+
+def test_output_layout():
+    image = cube_renderer.render_single_object(pose, 0)
+    assert image.shape == (h, w, 4)
+    assert image.dtype == jnp.float32
+
+    hit = image[:,:,3] == 1.0
+    assert hit[int(cy), int(cx)]
+    assert not hit[0, 0]
+    # Background pixels are all zeros, as in the GL plugin.
+    assert jnp.all(image[~hit] == 0.0)
+    # The front face of the unit cube is at z = 3.5.
+    assert jnp.allclose(image[hit][:,2], 3.5, atol=1e-4)
+    # Points lie on the ray through their pixel.
+    rays = jax3dp3.camera.camera_rays_from_params(h, w, fx, fy, cx, cy)
+    assert jnp.allclose(image[:,:,:3], rays * image[:,:,2:3], atol=1e-4)
+    # Silhouette of a 1x1 face at depth 3.5 spans fx / 3.5 pixels.
+    assert abs(int(hit[int(cy)].sum()) - int(fx / 3.5)) <= 1
+
+def test_parallel_matches_single():
+    poses = jnp.stack([
+        pose,
+        t3d.transform_from_pos(jnp.array([0.5, -0.2, 6.0])),
+        pose.dot(t3d.transform_from_axis_angle(jnp.array([0.0, 1.0, 0.0]), jnp.pi/4)),
+    ])
+    images = cube_renderer.render_parallel(poses, 0)
+    assert images.shape == (3, h, w, 4)
+    for i in range(poses.shape[0]):
+        assert jnp.allclose(images[i], cube_renderer.render_single_object(poses[i], 0))
+
+def test_multiobject_occlusion():
+    far_pose = t3d.transform_from_pos(jnp.array([0.0, 0.0, 8.0]))
+    image = cube_renderer.render_multiobject(jnp.stack([far_pose, pose]), [0, 0])
+    assert jnp.allclose(image, cube_renderer.render_single_object(pose, 0))
+
+    images = cube_renderer.render_multiobject_parallel(jnp.stack([pose, far_pose])[:, None], [0])
+    assert images.shape == (2, h, w, 4)
+    assert jnp.allclose(images[1][:,:,2].max(), 7.5, atol=1e-4)
+
+def test_out_of_range_is_empty():
+    behind = t3d.transform_from_pos(jnp.array([0.0, 0.0, -4.0]))
+    assert jnp.all(cube_renderer.render_single_object(behind, 0) == 0.0)
+
+def test_windowed_rasterization_matches_full_scan():
+    # Small and large triangles, triangles off screen, behind the camera and
+    # crossing z = 0. window=None is the plain full scan, window=0 sends every
+    # triangle through the full scan fallback.
+    key_center, key_offset, key_large = jax.random.split(jax.random.PRNGKey(0), 3)
+    centers = jax.random.uniform(key_center, (300, 1, 3), minval=jnp.array([-3.0, -3.0, -1.0]), maxval=jnp.array([3.0, 3.0, 6.0]))
+    small = centers + 0.05 * jax.random.normal(key_offset, (300, 3, 3))
+    large = jax.random.uniform(key_large, (20, 3, 3), minval=jnp.array([-3.0, -3.0, -0.5]), maxval=jnp.array([3.0, 3.0, 6.0]))
+    triangles = jnp.concatenate([small, large])
+    rays = jax3dp3.camera.camera_rays_from_params(h, w, fx, fy, cx, cy)
+    depth = jax.jit(jax3dp3.rasterizer.rasterize_depth, static_argnums=(2, 3, 4, 5))
+    expected = depth(triangles, rays, near, far, 32, None)
+    for window in [0, 4, 32]:
+        result = depth(triangles, rays, near, far, 32, window)
+        assert jnp.array_equal(jnp.isfinite(result), jnp.isfinite(expected))
+        assert jnp.allclose(jnp.where(jnp.isfinite(expected), result, 0.0), jnp.where(jnp.isfinite(expected), expected, 0.0), atol=1e-4)
+
+def test_jit_and_vmap():
+    triangles = jax3dp3.rasterizer.mesh_to_triangles(mesh)
+    rays = jax3dp3.camera.camera_rays_from_params(h, w, fx, fy, cx, cy)
+    render = jax.jit(jax.vmap(lambda p: jax3dp3.rasterizer.render_multiobject(p[None], [triangles], rays, near, far)))
+    images = render(jnp.stack([pose, pose]))
+    assert jnp.allclose(images[0], cube_renderer.render_single_object(pose, 0))
+
+def test_multiple_renderers():
+    fine = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax")
+    fine.load_model(mesh)
+    coarse = fine.scaled(0.5)
+    assert (coarse.h, coarse.w) == (h // 2, w // 2)
+
+    fine_image = fine.render_single_object(pose, 0)
+    coarse_image = coarse.render_single_object(pose, 0)
+    assert fine_image.shape == (h, w, 4)
+    assert coarse_image.shape == (h // 2, w // 2, 4)
+    assert jnp.allclose(fine_image, cube_renderer.render_single_object(pose, 0))
+    assert abs(int((coarse_image[:,:,3] > 0).sum()) * 4 - int((fine_image[:,:,3] > 0).sum())) < 0.1 * (fine_image[:,:,3] > 0).sum()
+
+def test_score_parallel():
+    obs = cube_renderer.render_single_object(pose, 0)
+    poses = jax.vmap(lambda x: t3d.transform_from_pos(jnp.array([x, 0.0, 4.0])))(jnp.linspace(-0.5, 0.5, 7))
+    expected = jax3dp3.threedp3_likelihood_parallel(obs, cube_renderer.render_parallel(poses, 0), 0.1, 0.01, 1.0)
+
+    scores = cube_renderer.score_parallel(poses, 0, obs, 0.1, 0.01, 1.0, chunk_size=3)
+    assert scores.shape == (7,)
+    assert jnp.allclose(scores, expected, rtol=1e-5)
+
+    scores, top_scores, top_poses = cube_renderer.score_parallel(poses, 0, obs, 0.1, 0.01, 1.0, chunk_size=4, top_k=2)
+    assert top_scores.shape == (2,)
+    assert jnp.allclose(top_poses[0], poses[3])
+
+def test_score_parallel_compact():
+    obs = cube_renderer.render_single_object(pose, 0)
+    poses = jax.vmap(lambda x: t3d.transform_from_pos(jnp.array([x, 0.1, 4.0])).dot(t3d.transform_from_axis_angle(jnp.array([0.0, 1.0, 0.0]), x)))(jnp.linspace(-0.5, 0.5, 7))
+    compact = jax.vmap(t3d.pose_to_compact)(poses)
+    assert compact.shape == (7, 7)
+    assert jnp.allclose(jax.vmap(t3d.compact_to_pose)(compact), poses, atol=1e-5)
+
+    expected = cube_renderer.score_parallel(poses, 0, obs, 0.1, 0.01, 1.0, chunk_size=3)
+    scores, _, top = cube_renderer.score_parallel(compact, 0, obs, 0.1, 0.01, 1.0, chunk_size=3, top_k=1, pose_fn=t3d.compact_to_pose)
+    assert jnp.allclose(scores, expected, rtol=1e-4)
+    assert top.shape == (1, 7)
+
+    # Contact sweeps stay as (contact_params, faces) until the kernel.
+    dims = jnp.ones(3)
+    table_pose = t3d.transform_from_pos(jnp.array([0.0, 0.5, 4.0])).dot(t3d.transform_from_axis_angle(jnp.array([1.0, 0.0, 0.0]), jnp.pi/2))
+    contact_params, faces = jax3dp3.scene_graph.enumerate_contact_and_face_parameters(-0.2, -0.2, 0.0, 0.2, 0.2, jnp.pi/2, 2, 2, 2, jnp.array([2, 3]))
+    contact_poses = jax.vmap(jax3dp3.scene_graph.pose_from_contact, in_axes=(0, None, 0, None, None, None))(contact_params, 2, faces, dims, dims, table_pose)
+    expected = cube_renderer.score_parallel(contact_poses, 0, obs, 0.1, 0.01, 1.0, chunk_size=5)
+    scores = cube_renderer.score_parallel(
+        (contact_params, faces), 0, obs, 0.1, 0.01, 1.0, chunk_size=5,
+        pose_fn=jax3dp3.scene_graph.pose_from_contact_proposal, pose_args=(2, dims, dims, table_pose)
+    )
+    assert jnp.allclose(scores, expected, rtol=1e-4)
+
+def test_score_parallel_memory_budget():
+    obs = cube_renderer.render_single_object(pose, 0)
+    poses = jax.vmap(lambda x: t3d.transform_from_pos(jnp.array([x, 0.0, 4.0])))(jnp.linspace(-0.5, 0.5, 7))
+    expected = cube_renderer.score_parallel(poses, 0, obs, 0.1, 0.01, 1.0, chunk_size=7)
+    scores = cube_renderer.score_parallel(poses, 0, obs, 0.1, 0.01, 1.0, memory_budget=2**20)
+    assert jnp.allclose(scores, expected, rtol=1e-5)
+
+def test_any_model_per_proposal():
+    renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax")
+    renderer.load_model(mesh)
+    renderer.load_model(trimesh.creation.box(np.array([0.4, 1.5, 0.4])))
+    renderer.load_model(trimesh.creation.icosphere(1, 0.6))
+    poses = jax.vmap(lambda x: t3d.transform_from_pos(jnp.array([x, 0.0, 4.0])))(jnp.linspace(-0.5, 0.5, 6))
+    model_indices = jnp.array([2, 0, 1, 1, 2, 0])
+
+    images = renderer.render_models_parallel(poses, model_indices)
+    for i in range(poses.shape[0]):
+        assert jnp.allclose(images[i], renderer.render_single_object(poses[i], int(model_indices[i])), atol=1e-5)
+
+    obs = renderer.render_single_object(poses[2], 1)
+    scores, _, (top_poses, top_models) = renderer.score_parallel(poses, model_indices, obs, 0.1, 0.01, 1.0, chunk_size=4, top_k=1)
+    expected = jax3dp3.threedp3_likelihood_parallel(obs, images, 0.1, 0.01, 1.0)
+    assert jnp.allclose(scores, expected, rtol=1e-5)
+    assert int(top_models[0]) == 1 and jnp.allclose(top_poses[0], poses[2])
+
+def test_render_function_jit_vmap():
+    renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax")
+    renderer.load_model(mesh)
+    renderer.load_model(trimesh.creation.box(np.array([0.4, 1.5, 0.4])))
+    poses = jax.vmap(lambda x: t3d.transform_from_pos(jnp.array([x, 0.0, 4.0])))(jnp.linspace(-0.5, 0.5, 4))
+    obs = renderer.render_single_object(poses[1], 0)
+    expected = jax3dp3.threedp3_likelihood_parallel(obs, renderer.render_parallel(poses, 0), 0.1, 0.01, 1.0)
+
+    for use_callback in [False, True]:
+        render = renderer.render_function(use_callback=use_callback)
+        best = jax.jit(lambda poses: jax.vmap(
+            lambda pose: jax3dp3.threedp3_likelihood(obs, render(pose, 0), 0.1, 0.01, 1.0)
+        )(poses).argmax())
+        assert int(best(poses)) == int(expected.argmax())
+
+        # Nested vmap over models and poses.
+        images = jax.jit(jax.vmap(jax.vmap(render, in_axes=(0, None)), in_axes=(None, 0)))(poses, jnp.array([0, 1]))
+        assert images.shape == (2, 4, h, w, 4)
+        assert jnp.allclose(images[1, 2], renderer.render_single_object(poses[2], 1), atol=1e-5)
+
+def test_score_parallel_background():
+    poses = jax.vmap(lambda x: t3d.transform_from_pos(jnp.array([x, 0.0, 4.0])))(jnp.linspace(-1.0, 1.0, 7))
+    table = cube_renderer.render_single_object(t3d.transform_from_pos(jnp.array([0.5, 0.3, 3.0])), 0)[:,:,:3]
+    obs = jax3dp3.combine_rendered_with_groud_truth(cube_renderer.render_single_object(poses[2], 0), table)
+    scores = cube_renderer.score_parallel(poses, 0, obs, 0.1, 0.01, 1.0, chunk_size=3, background=jax3dp3.prepare_background(table))
+    combined = jax.vmap(jax3dp3.combine_rendered_with_groud_truth, in_axes=(0, None))(cube_renderer.render_parallel(poses, 0), table)
+    assert jnp.allclose(scores, jax3dp3.threedp3_likelihood_parallel(obs, combined, 0.1, 0.01, 1.0), rtol=1e-5)
+    assert int(scores.argmax()) == 2
+
+def test_reduced_precision_renderer_scores():
+    # Absolute coordinates at z ~ 4 are coarser than r in bfloat16, so images must
+    # stay float32 and only the recentered likelihood runs in reduced precision.
+    poses = jax.vmap(lambda x: t3d.transform_from_pos(jnp.array([x, 0.0, 4.0])))(jnp.linspace(-0.1, 0.1, 5))
+    obs = cube_renderer.render_single_object(poses[2], 0)
+    expected = cube_renderer.score_parallel(poses, 0, obs, 0.02, 0.01, 1.0)
+    for dtype in [jnp.bfloat16, jnp.float16]:
+        renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax", dtype=dtype)
+        renderer.load_model(mesh)
+        assert renderer.render_single_object(poses[0], 0).dtype == jnp.float32
+        scores = renderer.score_parallel(poses, 0, obs, 0.02, 0.01, 1.0)
+        assert jnp.allclose(scores, expected, rtol=2e-2)
@@ -0,0 +1,75 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+import trimesh
+import jax3dp3
+import jax3dp3.transforms_3d as t3d
+from jax3dp3.tracking import particle_filter, systematic_resample
+
+h, w, fx, fy, cx, cy = 60, 80, 100.0, 100.0, 40.0, 30.0
+near, far = 0.01, 50.0
+
+def _translation_proposal(key, pose, var, concentration):
+    return pose.at[:3, 3].add(jnp.sqrt(var) * jax.random.normal(key, (3,)))
+
+def test_systematic_resample():
+    log_weights = jnp.log(jnp.array([0.0, 0.5, 0.25, 0.25]))
+    indices = systematic_resample(jax.random.PRNGKey(0), log_weights)
+    assert indices.shape == (4,)
+    assert (indices != 0).all()
+    assert (indices == 1).sum() == 2
+
+def test_systematic_resample_boundaries(monkeypatch):
+    # A draw of exactly 0 puts every u on a cdf boundary.
+    monkeypatch.setattr(jax.random, "uniform", lambda key: jnp.array(0.0))
+    indices = systematic_resample(jax.random.PRNGKey(0), jnp.log(jnp.array([0.0, 0.5, 0.25, 0.25])))
+    assert indices.tolist() == [1, 1, 2, 3]
+
+def test_particle_filter():
+    renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax")
+    renderer.load_model(trimesh.creation.box(np.array([1.0, 1.0, 1.0])))
+    render = renderer.render_function()
+
+    true_poses = jnp.stack([t3d.transform_from_pos(jnp.array([0.1 * t, 0.0, 5.0])) for t in range(4)])
+    frames = render(true_poses, 0)
+    result = particle_filter(
+        jax.random.PRNGKey(0), render, 0, frames, true_poses[0], 64,
+        0.01, 0.0, 0.1, 0.01, 1.0, proposal=_translation_proposal, chunk_size=16,
+    )
+    assert result.trajectory.shape == (4, 4, 4)
+    assert result.particles.shape == (4, 64, 4, 4)
+    assert result.ess.shape == (4,)
+    assert ((result.ess >= 1.0) & (result.ess <= 64.0 + 1e-3)).all()
+    assert jnp.allclose(jax.scipy.special.logsumexp(result.log_weights, axis=1), 0.0, atol=1e-4)
+    assert jnp.isfinite(result.log_marginal_likelihood)
+    assert jnp.linalg.norm(result.trajectory[:, :3, 3] - true_poses[:, :3, 3], axis=-1).max() < 0.1
+
+def test_block_gibbs_tracker():
+    renderer = jax3dp3.Renderer(h, w, fx, fy, cx, cy, near, far, backend="jax")
+    renderer.load_model(trimesh.creation.box(np.array([0.8, 0.8, 0.8])))
+    renderer.load_model(trimesh.creation.box(np.array([0.5, 1.0, 0.5])))
+    render = renderer.render_function()
+    model_indices = jnp.array([0, 1])
+
+    true_poses = jnp.stack([
+        jnp.stack([
+            t3d.transform_from_pos(jnp.array([-0.6 + 0.05 * t, 0.0, 5.0])),
+            t3d.transform_from_pos(jnp.array([0.6, 0.05 * t, 4.5])),
+        ])
+        for t in range(3)
+    ])
+    frames = jax.vmap(
+        lambda poses: jax3dp3.rasterizer.composite_point_cloud_images(*render(poses, model_indices))
+    )(true_poses)
+    deltas = jax3dp3.make_translation_grid_enumeration(-0.1, -0.1, -0.1, 0.1, 0.1, 0.1, 5, 5, 5)
+    result = jax3dp3.tracking.block_gibbs_tracker(
+        render, model_indices, frames, true_poses[0], deltas, 0.05, 0.01, 1.0, num_sweeps=2, chunk_size=32
+    )
+    assert result.poses.shape == (3, 2, 4, 4)
+    assert result.scores.shape == (3,)
+    assert jnp.abs(result.poses[:, :, :3, 3] - true_poses[:, :, :3, 3]).max() < 0.03
+
+    sampled = jax3dp3.tracking.block_gibbs_tracker(
+        render, model_indices, frames, true_poses[0], deltas, 0.05, 0.01, 1.0, key=jax.random.PRNGKey(0)
+    )
+    assert jnp.isfinite(sampled.scores).all()